@@ -8,87 +8,255 @@ VivadoInfo = provider(
 )
 
 
-def _vivado_bitstream_impl(ctx):
-    name, ext = paths.split_extension(ctx.label.name)
-    if not ext:
-      ext = ".bit"
+# vivado_client runs as a persistent worker, keeping its server connection open across actions.
+_CLIENT_EXECUTION_REQUIREMENTS = {
+    "supports-workers": "1",
+    "requires-worker-protocol": "json",
+}
+
+
+def _client_args(ctx, command):
+    """Arguments for a vivado_client action, passed in a flag file as persistent workers require."""
+    args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
+    args.add(command)
+    return args
+
+
+def _vivado_synth_ooc(ctx, name, module):
+    top = module[VerilogModuleInfo].top
+
+    checkpoint = ctx.actions.declare_file("{}_{}_ooc.dcp".format(name, top))
+    stub = ctx.actions.declare_file("{}_{}_stub.v".format(name, top))
+    profile = ctx.actions.declare_file("{}_{}_ooc_profile.json".format(name, top))
+
+    synth_args = _client_args(ctx, "synth")
+    synth_args.add("-p", ctx.attr.part)
+    synth_args.add("--ooc")
+    synth_args.add("-t", top)
+    synth_args.add_all("-v", module[VerilogModuleInfo].files)
+    synth_args.add("-o", checkpoint)
+    synth_args.add("--stub", stub)
+    synth_args.add("--profile", profile)
+
+    ctx.actions.run(
+        outputs = [checkpoint, stub, profile],
+        inputs = module[VerilogModuleInfo].files,
+        executable = ctx.attr._vivado_client[DefaultInfo].files_to_run,
+        arguments = [synth_args],
+        execution_requirements = _CLIENT_EXECUTION_REQUIREMENTS,
+        mnemonic = "VivadoSynthOOC",
+        use_default_shell_env = True,
+        progress_message = "Synthesizing {} out-of-context".format(top),
+    )
+
+    return struct(checkpoint = checkpoint, stub = stub, profile = profile)
+
 
+def _vivado_bitstream_staged(ctx, name, bitstream):
     common_args = ["-p", ctx.attr.part]
 
+    profiles = {
+        stage: ctx.actions.declare_file("{}_{}_profile.json".format(name, stage))
+        for stage in ["synth", "place", "route", "bitstream", "check"]
+    }
+
+    # Out-of-context modules are synthesized by their own actions, and stand in for their sources as
+    # black boxes in the top level synthesis.
+    ooc = [_vivado_synth_ooc(ctx, name, module) for module in ctx.attr.ooc_modules]
+    ooc_files = {}
+    for module in ctx.attr.ooc_modules:
+        for f in module[VerilogModuleInfo].files.to_list():
+            ooc_files[f] = True
+
+    verilog = [
+        f
+        for f in ctx.attr.module[VerilogModuleInfo].files.to_list()
+        if f not in ooc_files
+    ] + [o.stub for o in ooc]
+    ooc_checkpoints = [o.checkpoint for o in ooc]
+
     post_synth = ctx.actions.declare_file("{}_post_synth.dcp".format(name))
 
-    synth_args = ctx.actions.args()
-    synth_args.add("synth")
+    synth_args = _client_args(ctx, "synth")
     synth_args.add_all(common_args)
     synth_args.add("-t", ctx.attr.module[VerilogModuleInfo].top)
-    synth_args.add_all("-v", ctx.attr.module[VerilogModuleInfo].files)
+    synth_args.add_all("-v", verilog)
+    synth_args.add_all("--ooc_checkpoint", ooc_checkpoints)
     synth_args.add("-o", post_synth)
+    synth_args.add("--profile", profiles["synth"])
 
     ctx.actions.run(
-        outputs = [post_synth],
-        inputs = ctx.attr.module[VerilogModuleInfo].files,
+        outputs = [post_synth, profiles["synth"]],
+        inputs = verilog + ooc_checkpoints,
         executable = ctx.attr._vivado_client[DefaultInfo].files_to_run,
         arguments = [synth_args],
+        execution_requirements = _CLIENT_EXECUTION_REQUIREMENTS,
         mnemonic = "VivadoSynth",
+        # Passes RULES_VIVADO_CACHE_DIR through --action_env.
+        use_default_shell_env = True,
         progress_message = "Synthesizing {}".format(ctx.attr.module[VerilogModuleInfo].top),
     )
 
     post_place = ctx.actions.declare_file("{}_post_place.dcp".format(name))
 
-    place_args = ctx.actions.args()
-    place_args.add("place")
+    place_args = _client_args(ctx, "place")
     place_args.add_all(common_args)
     place_args.add_all("-c", ctx.files.io_constraints)
     place_args.add("-i", post_synth)
     place_args.add("-o", post_place)
+    place_args.add("--profile", profiles["place"])
+    place_args.add_all("--incremental", ctx.files.incremental_checkpoint)
 
     ctx.actions.run(
-        outputs = [post_place],
-        inputs = ctx.files.io_constraints + [post_synth],
+        outputs = [post_place, profiles["place"]],
+        inputs = ctx.files.io_constraints + ctx.files.incremental_checkpoint + [post_synth],
         executable = ctx.attr._vivado_client[DefaultInfo].files_to_run,
         arguments = [place_args],
+        execution_requirements = _CLIENT_EXECUTION_REQUIREMENTS,
         mnemonic = "VivadoPlace",
+        use_default_shell_env = True,
         progress_message = "Placing {}".format(ctx.attr.module[VerilogModuleInfo].top),
     )
 
     post_route = ctx.actions.declare_file("{}_post_route.dcp".format(name))
 
-    route_args = ctx.actions.args()
-    route_args.add("route")
+    route_args = _client_args(ctx, "route")
     route_args.add_all(common_args)
     route_args.add("-i", post_place)
     route_args.add("-o", post_route)
+    route_args.add("--profile", profiles["route"])
 
     ctx.actions.run(
-        outputs = [post_route],
+        outputs = [post_route, profiles["route"]],
         inputs = [post_place],
         executable = ctx.attr._vivado_client[DefaultInfo].files_to_run,
         arguments = [route_args],
+        execution_requirements = _CLIENT_EXECUTION_REQUIREMENTS,
         mnemonic = "VivadoRoute",
+        use_default_shell_env = True,
         progress_message = "Routing {}".format(ctx.attr.module[VerilogModuleInfo].top),
     )
 
-    bitstream = ctx.actions.declare_file("{}{}".format(name, ext))
-
-    bitstream_args = ctx.actions.args()
-    bitstream_args.add("bitstream")
+    bitstream_args = _client_args(ctx, "bitstream")
     bitstream_args.add_all(common_args)
-    bitstream_args.add("--check")
     bitstream_args.add_all("-c", ctx.files.bitstream_constraints)
     bitstream_args.add("-i", post_route)
     bitstream_args.add("-o", bitstream)
+    bitstream_args.add("--profile", profiles["bitstream"])
 
     ctx.actions.run(
-        outputs = [bitstream],
+        outputs = [bitstream, profiles["bitstream"]],
         inputs = ctx.files.bitstream_constraints + [post_route],
         executable = ctx.attr._vivado_client[DefaultInfo].files_to_run,
         arguments = [bitstream_args],
+        execution_requirements = _CLIENT_EXECUTION_REQUIREMENTS,
         mnemonic = "VivadoBitstream",
+        use_default_shell_env = True,
         progress_message = "Generating bitstream for {}".format(ctx.attr.module[VerilogModuleInfo].top),
     )
 
+    # Checks are a separate action so they run alongside, and are cached apart from, the bitstream.
+    report = ctx.actions.declare_file("{}_check.rpt".format(name))
+
+    check_args = _client_args(ctx, "check")
+    check_args.add_all(common_args)
+    if ctx.attr.parallel_checks:
+        check_args.add("--parallel_checks")
+    check_args.add_all("-c", ctx.files.bitstream_constraints)
+    check_args.add_all("--waivers", ctx.files.waivers)
+    check_args.add("-i", post_route)
+    check_args.add("-o", report)
+    check_args.add("--profile", profiles["check"])
+
+    ctx.actions.run(
+        outputs = [report, profiles["check"]],
+        inputs = ctx.files.bitstream_constraints + ctx.files.waivers + [post_route],
+        executable = ctx.attr._vivado_client[DefaultInfo].files_to_run,
+        arguments = [check_args],
+        execution_requirements = _CLIENT_EXECUTION_REQUIREMENTS,
+        mnemonic = "VivadoCheck",
+        use_default_shell_env = True,
+        progress_message = "Checking {}".format(ctx.attr.module[VerilogModuleInfo].top),
+    )
+
+    return struct(
+        checkpoints = ooc_checkpoints + [post_synth, post_place, post_route],
+        reports = [report],
+        profiles = profiles.values() + [o.profile for o in ooc],
+    )
+
+
+_STAGES = ["synth", "place", "route"]
+
+
+def _vivado_bitstream_single_session(ctx, name, bitstream):
+    impl_args = _client_args(ctx, "impl")
+    impl_args.add("-p", ctx.attr.part)
+    impl_args.add("--check")
+    impl_args.add("-t", ctx.attr.module[VerilogModuleInfo].top)
+    impl_args.add_all("-v", ctx.attr.module[VerilogModuleInfo].files)
+    impl_args.add_all("-c", ctx.files.io_constraints)
+    impl_args.add_all("--bitstream_constraint", ctx.files.bitstream_constraints)
+    impl_args.add_all("--waivers", ctx.files.waivers)
+    impl_args.add("-o", bitstream)
+
+    profile = ctx.actions.declare_file("{}_impl_profile.json".format(name))
+    impl_args.add("--profile", profile)
+    impl_args.add_all("--incremental", ctx.files.incremental_checkpoint)
+
+    # Intermediate checkpoints are only written when explicitly requested.
+    checkpoints = []
+    for stage in ctx.attr.checkpoints:
+        if stage not in _STAGES:
+            fail("Unknown checkpoint stage '{}', expected one of {}.".format(stage, _STAGES))
+
+        checkpoint = ctx.actions.declare_file("{}_post_{}.dcp".format(name, stage))
+        impl_args.add("--{}_checkpoint".format(stage), checkpoint)
+        checkpoints.append(checkpoint)
+
+    ctx.actions.run(
+        outputs = [bitstream, profile] + checkpoints,
+        inputs = depset(
+            ctx.files.io_constraints + ctx.files.bitstream_constraints +
+            ctx.files.incremental_checkpoint + ctx.files.waivers,
+            transitive = [ctx.attr.module[VerilogModuleInfo].files],
+        ),
+        executable = ctx.attr._vivado_client[DefaultInfo].files_to_run,
+        arguments = [impl_args],
+        execution_requirements = _CLIENT_EXECUTION_REQUIREMENTS,
+        mnemonic = "VivadoImpl",
+        use_default_shell_env = True,
+        progress_message = "Implementing {}".format(ctx.attr.module[VerilogModuleInfo].top),
+    )
+
+    return struct(checkpoints = checkpoints, reports = [], profiles = [profile])
+
+
+def _vivado_bitstream_impl(ctx):
+    name, ext = paths.split_extension(ctx.label.name)
+    if not ext:
+      ext = ".bit"
+
+    bitstream = ctx.actions.declare_file("{}{}".format(name, ext))
+
+    if ctx.attr.single_session:
+        if ctx.attr.ooc_modules:
+            fail("ooc_modules are synthesized by separate actions, so require single_session = False.")
+        outputs = _vivado_bitstream_single_session(ctx, name, bitstream)
+    else:
+        outputs = _vivado_bitstream_staged(ctx, name, bitstream)
+
     return [
         DefaultInfo(files = depset([bitstream])),
+        # Validation outputs are built whenever the bitstream is, without delaying dependents.
+        OutputGroupInfo(
+            checkpoints = depset(outputs.checkpoints),
+            reports = depset(outputs.reports),
+            profiles = depset(outputs.profiles),
+            _validation = depset(outputs.reports),
+        ),
         VivadoInfo(part = ctx.attr.part),
     ]
 
@@ -118,6 +286,38 @@ vivado_bitstream = rule(
             allow_empty = False,
             allow_files = [".xdc"],
         ),
+        "ooc_modules": attr.label_list(
+            doc = "Submodules synthesized out-of-context by separate, individually cached " +
+                  "actions, and linked into the top level synthesis as black boxes.  Their " +
+                  "sources, including dependencies, are left out of the top level synthesis so " +
+                  "must not be shared with the rest of the design.",
+            providers = [VerilogModuleInfo],
+        ),
+        "single_session": attr.bool(
+            doc = "Synthesize, place, route and write the bitstream in a single Vivado session " +
+                  "rather than separate actions linked by checkpoints.",
+            default = False,
+        ),
+        "incremental_checkpoint": attr.label(
+            doc = "Routed checkpoint from a previous build (e.g. a checked in golden " +
+                  "checkpoint) used as the reference for incremental place and route.",
+            allow_single_file = [".dcp"],
+        ),
+        "checkpoints": attr.string_list(
+            doc = "Stages (synth, place, route) whose checkpoints are written in single session " +
+                  "mode.  Separate actions always write all checkpoints.",
+        ),
+        "waivers": attr.label(
+            doc = "File of check violations not treated as errors, one per line as a rule ID " +
+                  "(e.g. TIMING-18) optionally followed by a regex matching the violation's " +
+                  "details.",
+            allow_single_file = True,
+        ),
+        "parallel_checks": attr.bool(
+            doc = "Run each design check concurrently on a separate server worker.  Checks run " +
+                  "one after another on a server with a single worker.",
+            default = False,
+        ),
         "_vivado_client": attr.label(
             doc = "Vivado client executable.",
             default = Label("@rules_vivado//vivado/tools:vivado_client"),
@@ -135,8 +335,7 @@ def _vivado_config_memory_impl(ctx):
 
     config_memory = ctx.actions.declare_file("{}{}".format(name, ext))
 
-    config_args = ctx.actions.args()
-    config_args.add("cfg_mem")
+    config_args = _client_args(ctx, "cfg_mem")
     config_args.add("-p", ctx.attr.bitstream[VivadoInfo].part)
     config_args.add("--size", str(ctx.attr.memory_size))
     config_args.add("--interface", ctx.attr.memory_interface)
@@ -148,6 +347,7 @@ def _vivado_config_memory_impl(ctx):
         inputs = ctx.attr.bitstream[DefaultInfo].files,
         executable = ctx.attr._vivado_client[DefaultInfo].files_to_run,
         arguments = [config_args],
+        execution_requirements = _CLIENT_EXECUTION_REQUIREMENTS,
         mnemonic = "VivadoCfgMem",
         progress_message = "Generating configuration memory",
     )
@@ -199,7 +399,9 @@ def _vivado_load_impl(ctx):
         "-p",
         ctx.attr.bitstream[VivadoInfo].part,
         "-i",
-        " ".join([f.short_path for f in ctx.attr.bitstream[DefaultInfo].files.to_list()])
+        " ".join([f.short_path for f in ctx.attr.bitstream[DefaultInfo].files.to_list()]),
+        # Forward arguments given to `bazel run`, e.g. --all_targets.
+        "\"$@\"",
     ]
 
     script = ctx.actions.declare_file("{}.sh".format(ctx.label.name))
@@ -249,7 +451,9 @@ def _vivado_flash_impl(ctx):
         "--memory",
         ctx.attr.memory_pn,
         "-i",
-        " ".join([f.short_path for f in ctx.attr.config[DefaultInfo].files.to_list()])
+        " ".join([f.short_path for f in ctx.attr.config[DefaultInfo].files.to_list()]),
+        # Forward arguments given to `bazel run`, e.g. --all_targets.
+        "\"$@\"",
     ]
 
     script = ctx.actions.declare_file("{}.sh".format(ctx.label.name))
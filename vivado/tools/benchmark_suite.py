@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import argparse
+import os.path
+import subprocess
+import sys
+import time
+
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+
+# Benchmark scripts and their arguments, at full size and quick to run.
+BENCHMARKS = [
+    ('relay_benchmark.py', ['--commands', '200'], ['--commands', '50']),
+    ('throughput_benchmark.py', ['--size_mb', '1024'], ['--size_mb', '64']),
+    ('report_benchmark.py', ['--violations', '50000'], ['--violations', '5000']),
+    ('scaling_benchmark.py', ['--workers', '4', '--clients', '8'],
+     ['--workers', '2', '--clients', '4', '--output_lines', '2000']),
+]
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Run every server and client benchmark against fake Vivado in turn.')
+  parser.add_argument('--quick', action='store_true', help='Run smaller benchmarks, e.g. for CI.')
+  parser.add_argument('--only', nargs='+', help='Names of the benchmarks to run, e.g. relay.')
+  args = parser.parse_args()
+
+  failed = []
+  for script, full_args, quick_args in BENCHMARKS:
+    name = script[:-len('_benchmark.py')]
+    if args.only and name not in args.only:
+      continue
+
+    print('\n=== {:s} ==='.format(name), flush=True)
+    start = time.perf_counter()
+    # Each benchmark runs in its own process so servers and their ports do not interfere.
+    result = subprocess.run([sys.executable, os.path.join(TOOLS, script)] +
+                            (quick_args if args.quick else full_args))
+    print('({:s} took {:.1f} s)'.format(name, time.perf_counter() - start), flush=True)
+    if result.returncode:
+      failed.append(name)
+
+  if failed:
+    print('\nFailed: {:s}'.format(', '.join(failed)))
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
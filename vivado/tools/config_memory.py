@@ -0,0 +1,115 @@
+import mmap
+import struct
+
+
+class BitstreamError(Exception):
+  pass
+
+
+# Interfaces whose memory image is the configuration data as is.  Parallel interfaces are left to
+# Vivado, which orders their bits for the bus width, as is SPIx8, which it splits between two
+# flash devices.
+INTERFACES = frozenset(['SERIALx1', 'SPIx1', 'SPIx2', 'SPIx4'])
+
+# Bytes of data per Intel HEX record, and per extended linear address segment.
+MCS_RECORD_SIZE = 16
+MCS_SEGMENT_SIZE = 64 * 1024
+
+
+def parse_bitstream(data):
+  '''Parse the header of a .bit file, returning its fields and the offset of configuration data.
+
+  The header is a length prefixed preamble followed by fields, each keyed by a letter: `a` design
+  name, `b` part, `c` date and `d` time with 16 bit lengths, then `e` the configuration data with a
+  32 bit length.
+  '''
+  try:
+    offset = 2 + struct.unpack_from('>H', data, 0)[0]
+    offset += 2  # Key count.
+
+    fields = {}
+    while True:
+      key = chr(data[offset])
+      offset += 1
+
+      if key == 'e':
+        length = struct.unpack_from('>I', data, offset)[0]
+        offset += 4
+        break
+
+      length = struct.unpack_from('>H', data, offset)[0]
+      offset += 2
+      fields[key] = bytes(data[offset:offset + length]).rstrip(b'\0').decode()
+      offset += length
+  except (IndexError, struct.error):
+    raise BitstreamError('Truncated bitstream header.')
+
+  if offset + length > len(data):
+    raise BitstreamError('Bitstream shorter than its header states.')
+
+  return fields, offset, length
+
+
+def _mcs_record(address, record_type, data):
+  record = struct.pack('>BHB', len(data), address, record_type) + bytes(data)
+  checksum = -sum(record) & 0xFF
+  return ':{:s}{:02X}\r\n'.format(record.hex().upper(), checksum).encode()
+
+
+def _mcs_data_records(segment, address):
+  '''Data records for bytes starting at `address` within a segment.
+
+  The whole segment is converted to hex at once, rather than record by record.
+  '''
+  digits = segment.hex().upper()
+  records = []
+  for i in range(0, len(segment), MCS_RECORD_SIZE):
+    data = segment[i:i + MCS_RECORD_SIZE]
+    record_address = address + i
+    # Address bytes are summed modulo 256 along with the rest.
+    checksum = -(len(data) + (record_address >> 8) + record_address + sum(data)) & 0xFF
+    records.append(':%02X%04X00%s%02X\r\n' % (len(data), record_address,
+                                                digits[2 * i:2 * (i + len(data))], checksum))
+
+  return ''.join(records).encode()
+
+
+def write_mcs(f, data, address=0):
+  '''Write data as Intel HEX (.mcs) starting at `address`.'''
+  offset = 0
+  while offset < len(data):
+    current = address + offset
+    segment_end = min(len(data), offset + MCS_SEGMENT_SIZE - current % MCS_SEGMENT_SIZE)
+
+    f.write(_mcs_record(0, 0x04, struct.pack('>H', current // MCS_SEGMENT_SIZE)))
+    f.write(_mcs_data_records(bytes(data[offset:segment_end]), current % MCS_SEGMENT_SIZE))
+    offset = segment_end
+
+  f.write(_mcs_record(0, 0x01, b''))
+
+
+def write_config_memory(bitstream, output, size, interface):
+  '''Write the configuration memory image of a .bit file at address 0, as .mcs for that extension
+  or .bin otherwise.  `size` is the memory size [MB].
+  '''
+  if interface not in INTERFACES:
+    raise ValueError('Unsupported interface: {:s}'.format(interface))
+
+  with open(bitstream, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+    view = memoryview(mm)
+    try:
+      _, offset, length = parse_bitstream(view)
+      if length > size * 1024 * 1024:
+        raise BitstreamError('Bitstream of {:d} B does not fit in {:d} MB memory.'.format(length,
+                                                                                         size))
+      data = view[offset:offset + length]
+
+      with open(output, 'wb') as out:
+        if output.endswith('.mcs'):
+          write_mcs(out, data)
+        else:
+          out.write(data)
+    finally:
+      # The map cannot close while views of it remain.
+      data = None
+      view.release()
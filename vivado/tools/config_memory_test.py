@@ -0,0 +1,141 @@
+import os
+import os.path
+import struct
+import tempfile
+import unittest
+
+import config_memory
+
+
+def bitstream(data, design='top;UserID=0XFFFFFFFF;Version=2022.2', part='7a35tcsg324'):
+  '''A .bit file with the header Vivado writes, holding `data` as configuration data.'''
+  header = struct.pack('>H', 9) + bytes.fromhex('0ff00ff00ff00ff000') + struct.pack('>H', 1)
+  for key, value in (('a', design), ('b', part), ('c', '2022/10/14'), ('d', '12:34:56')):
+    value = value.encode() + b'\0'
+    header += key.encode() + struct.pack('>H', len(value)) + value
+  return header + b'e' + struct.pack('>I', len(data)) + data
+
+
+def read_mcs(lines):
+  '''Memory contents of Intel HEX records by address, checking each record's checksum.'''
+  memory = {}
+  base = 0
+  for line in lines:
+    if not line.startswith(b':') or not line.endswith(b'\r\n'):
+      raise AssertionError('Malformed record: {!r}'.format(line))
+    record = bytes.fromhex(line[1:-2].decode())
+    if sum(record) & 0xFF:
+      raise AssertionError('Bad checksum: {!r}'.format(line))
+
+    length, address, record_type = struct.unpack_from('>BHB', record)
+    data = record[4:-1]
+    if length != len(data):
+      raise AssertionError('Bad length: {!r}'.format(line))
+
+    if record_type == 0x04:
+      base = struct.unpack('>H', data)[0] << 16
+    elif record_type == 0x00:
+      for i, byte in enumerate(data):
+        memory[base + address + i] = byte
+    elif record_type == 0x01:
+      break
+
+  return memory
+
+
+class ParseBitstreamTest(unittest.TestCase):
+
+  def test_fields(self):
+    data = bytes(range(256)) * 4
+    fields, offset, length = config_memory.parse_bitstream(bitstream(data))
+
+    self.assertEqual(fields, {'a': 'top;UserID=0XFFFFFFFF;Version=2022.2', 'b': '7a35tcsg324',
+                              'c': '2022/10/14', 'd': '12:34:56'})
+    self.assertEqual(length, len(data))
+    self.assertEqual(bitstream(data)[offset:offset + length], data)
+
+  def test_truncated_header(self):
+    header = bitstream(b'\xff' * 16)
+    for end in (1, 12, header.index(b'b') + 1, header.index(b'e') + 2):
+      with self.assertRaisesRegex(config_memory.BitstreamError, 'Truncated'):
+        config_memory.parse_bitstream(header[:end])
+
+  def test_length_beyond_end(self):
+    with self.assertRaisesRegex(config_memory.BitstreamError, 'shorter'):
+      config_memory.parse_bitstream(bitstream(b'\xff' * 16)[:-1])
+
+
+class WriteMcsTest(unittest.TestCase):
+
+  def write(self, data, address=0):
+    with tempfile.TemporaryFile() as f:
+      config_memory.write_mcs(f, data, address)
+      f.seek(0)
+      return f.read().splitlines(keepends=True)
+
+  def test_records(self):
+    lines = self.write(bytes.fromhex('0102030405060708090a0b0c0d0e0f1011'))
+
+    self.assertEqual(lines, [
+        b':020000040000FA\r\n',
+        b':100000000102030405060708090A0B0C0D0E0F1068\r\n',
+        b':0100100011DE\r\n',
+        b':00000001FF\r\n',
+    ])
+
+  def test_segments(self):
+    # Starts just before a segment boundary and spans the next segment entirely.
+    address = 3 * config_memory.MCS_SEGMENT_SIZE - 40
+    data = bytes(i * 7 & 0xFF for i in range(config_memory.MCS_SEGMENT_SIZE + 100))
+    lines = self.write(data, address)
+
+    segments = [line for line in lines if line[7:9] == b'04']
+    self.assertEqual(segments, [b':020000040002F8\r\n', b':020000040003F7\r\n',
+                                b':020000040004F6\r\n'])
+    self.assertEqual(lines[-1], b':00000001FF\r\n')
+    self.assertTrue(all(len(line) <= 2 * config_memory.MCS_RECORD_SIZE + 13 for line in lines))
+
+    memory = read_mcs(lines)
+    self.assertEqual(bytes(memory[address + i] for i in range(len(data))), data)
+    self.assertEqual(len(memory), len(data))
+
+
+class WriteConfigMemoryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+
+    self.data = bytes(i * 13 & 0xFF for i in range(100000))
+    self.bitstream = self.path('top.bit')
+    with open(self.bitstream, 'wb') as f:
+      f.write(bitstream(self.data))
+
+  def path(self, name):
+    return os.path.join(self.directory.name, name)
+
+  def test_bin(self):
+    config_memory.write_config_memory(self.bitstream, self.path('top.bin'), 1, 'SPIx4')
+    with open(self.path('top.bin'), 'rb') as f:
+      self.assertEqual(f.read(), self.data)
+
+  def test_mcs(self):
+    config_memory.write_config_memory(self.bitstream, self.path('top.mcs'), 1, 'SPIx1')
+    with open(self.path('top.mcs'), 'rb') as f:
+      memory = read_mcs(f.read().splitlines(keepends=True))
+    self.assertEqual(bytes(memory[i] for i in range(len(self.data))), self.data)
+
+  def test_too_large(self):
+    with open(self.bitstream, 'wb') as f:
+      f.write(bitstream(bytes(1024 * 1024 + 1)))
+    with self.assertRaises(config_memory.BitstreamError):
+      config_memory.write_config_memory(self.bitstream, self.path('top.bin'), 1, 'SPIx4')
+
+  def test_split_interfaces_left_to_vivado(self):
+    # Dual quad SPI is split between two devices.
+    with self.assertRaises(ValueError):
+      config_memory.write_config_memory(self.bitstream, self.path('top.bin'), 1, 'SPIx8')
+
+
+if __name__ == '__main__':
+  unittest.main()
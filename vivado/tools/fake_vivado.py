@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import json
+import os
+import re
+import sys
+import time
+
+
+PROMPT = b'Vivado% '
+
+
+class TclError(Exception):
+  pass
+
+
+class FakeVivado:
+  '''Minimal stand-in for `vivado -mode tcl` that answers every command with a prompt.
+
+  As in Vivado, SIGINT aborts the running command with a Tcl error rather than exiting.
+
+  A hardware server with `hw_targets` boards is emulated, the last `bad_targets` of which fail to
+  program.
+
+  A `script` maps command names to how the fake responds to them, replaying output recorded from
+  Vivado where given, see `load_script`.
+  '''
+
+  WRITE_SIZE = 64 * 1024
+  # Tcl that commands are wrapped in, which takes no time of its own.
+  BUILTINS = ('catch', 'puts', 'proc', 'set', 'set_param', 'if', 'uplevel', 'rules_vivado_step',
+              'rules_vivado_messages')
+  # Characters that nest or quote Tcl, and the separators of commands or words.
+  COMMAND_SYNTAX = re.compile(r'["{}\[\];]')
+  WORD_SYNTAX = re.compile(r'["{}\[\]]|\s+')
+
+  # Messages of the severities that fail a client's command.
+  MESSAGE_PATTERN = re.compile(rb'^(?:WARNING|CRITICAL WARNING|ERROR): \[([^\]]+)\]', re.M)
+
+  WRITERS = ('write_checkpoint', 'write_bitstream', 'write_cfgmem', 'write_verilog')
+  PROGRAMMERS = ('program_hw_devices', 'program_hw_cfgmem')
+
+  def __init__(self, latency=0.0, output_lines=0, line_size=80, hw_targets=1, bad_targets=0,
+               program_time=0.0, script=None):
+    self.latency = latency
+    self.output_lines = output_lines
+    self.line_size = line_size
+    self.script = script or {}
+
+    self.targets = ['localhost:3121/xilinx_tcf/Fake/{:04d}'.format(i) for i in range(hw_targets)]
+    self.bad_targets = self.targets[len(self.targets) - bad_targets:] if bad_targets else []
+    self.program_time = program_time
+    self.target = None
+
+    self.buffer = bytearray()
+    self.variables = {}
+    # Messages reported so far that fail a client's command, by ID.
+    self.messages = collections.Counter()
+    # Output not yet written.
+    self.pending = bytearray()
+
+  def _write_all(self, data):
+    view = memoryview(data)
+    while view:
+      view = view[os.write(sys.stdout.fileno(), view):]
+
+  def _write(self, data):
+    # Short lines are gathered, so a command's output takes a few writes rather than one per line.
+    if len(data) >= self.WRITE_SIZE:
+      self._flush()
+      self._write_all(data)
+      return
+
+    self.pending += data
+    if len(self.pending) >= self.WRITE_SIZE:
+      self._flush()
+
+  def _message(self, text, repeat=1):
+    '''Count the messages in output, as Vivado does for `get_msg_config -count`.'''
+    for message_id in self.MESSAGE_PATTERN.findall(text):
+      self.messages[message_id.decode()] += repeat
+
+  def _flush(self):
+    self._write_all(self.pending)
+    self.pending = bytearray()
+
+  def _log_line(self, line_size):
+    line = b'INFO: [Fake 1-1] Log line '
+    return line + b'.' * max(0, line_size - len(line) - 1) + b'\n'
+
+  def _respond(self, latency, output_lines, line_size, output=b'', repeat=1):
+    if latency:
+      self._flush()
+      time.sleep(latency)
+
+    # Batch log lines into large writes so the fake is not the bottleneck.
+    if output_lines:
+      line = self._log_line(line_size)
+      lines_per_write = max(1, self.WRITE_SIZE // len(line))
+      block = line * lines_per_write
+
+      remaining = output_lines
+      while remaining >= lines_per_write:
+        self._write(block)
+        remaining -= lines_per_write
+      self._write(line * remaining)
+
+    self._message(output, repeat)
+    for _ in range(repeat):
+      self._write(output)
+
+  def _execute(self, command):
+    try:
+      self._run(command.decode())
+    except TclError as e:
+      self._write(str(e).encode() + b'\n')
+    except KeyboardInterrupt:  # Between commands.
+      pass
+
+  def _run(self, script):
+    '''Evaluate each command of a script, returning the result of the last.'''
+    result = ''
+    for part in self._split(script):
+      result = self._evaluate(part)
+    return result
+
+  def _split(self, script):
+    '''Split a line of Tcl into commands on semicolons outside of braces, brackets and quotes.'''
+    return [c.strip() for c in self._top_level(script, self.COMMAND_SYNTAX) if c.strip()]
+
+  def _words(self, command):
+    '''Split a Tcl command into words on whitespace outside of braces, brackets and quotes.'''
+    return [w for w in self._top_level(command, self.WORD_SYNTAX) if w]
+
+  def _top_level(self, text, syntax):
+    # Only the characters `syntax` matches are visited, which keeps long scripts quick to split.
+    parts = []
+    depth = 0
+    quoted = False
+    start = 0
+    for match in syntax.finditer(text):
+      c = match.group()
+      if c == '"':
+        quoted = not quoted
+      elif c in '{[':
+        depth += 1
+      elif c in '}]':
+        depth -= 1
+      elif not depth and not quoted:
+        parts.append(text[start:match.start()])
+        start = match.end()
+    parts.append(text[start:])
+
+    return parts
+
+  def _substitute(self, text):
+    text = re.sub(r'\[([^\[\]]*)\]', lambda m: self._evaluate(m.group(1)), text)
+    text = re.sub(r'\$(?:::)?(\w+)', lambda m: self.variables.get(m.group(1), ''), text)
+    return re.sub(r'\\x([0-9a-fA-F]{2})', lambda m: chr(int(m.group(1), 16)), text)
+
+  def _evaluate(self, command):
+    '''Run a command and return its result.  Only the Tcl in `BUILTINS` is understood, as far as
+    the client and server use it.
+    '''
+    name, _, arg = command.partition(' ')
+
+    if name not in self.BUILTINS:
+      try:
+        self._respond(self.latency, self.output_lines, self.line_size)
+        if name in self.script:
+          self._respond(**self.script[name])
+      except KeyboardInterrupt:
+        self._message(b'ERROR: [Fake 1-3]')
+        raise TclError('ERROR: [Fake 1-3] Interrupted: {:s}'.format(name))
+
+    if name == 'catch':
+      words = self._words(arg)
+      try:
+        self._run(words[0][1:-1])
+        result, rc = '', '0'
+      except TclError as e:
+        result, rc = str(e), '1'
+      if len(words) > 1:
+        self.variables[words[1]] = result
+      return rc
+
+    if name == 'uplevel':
+      return self._run(self._words(arg)[-1][1:-1])
+
+    if name == 'set':
+      words = self._words(arg)
+      value = words[1] if len(words) > 1 else ''
+      if value.startswith('['):
+        value = self._run(value[1:-1])
+      self.variables[words[0].lstrip(':')] = value
+      return value
+
+    if name == 'puts':
+      self._write(self._substitute(arg.strip('"')).encode() + b'\n')
+      return ''
+
+    # Parameters, such as the thread count set by the server, and the procedure of client batches
+    # are accepted silently.  Commands echo no results, so there are none to test.
+    if name in ('proc', 'set_param', 'if'):
+      return ''
+
+    # Steps of a client batch, which report their index, return code and time taken [ms], and are
+    # skipped after a Tcl error or messages failing the command.
+    if name == 'rules_vivado_step':
+      if self.variables.get('rules_vivado_failed') == '1':
+        return ''
+
+      step, _, script = arg.partition(' ')
+      start = time.perf_counter()
+      rc = 0
+      try:
+        self._run(script.strip()[1:-1])
+      except TclError as e:
+        self._write(str(e).encode() + b'\n')
+        rc = 1
+      messages = self._evaluate('rules_vivado_messages')
+      if rc or int(messages) > int(self.variables.get('rules_vivado_messages', '0')):
+        self.variables['rules_vivado_failed'] = '1'
+      self.variables['rules_vivado_messages'] = messages
+      self._write('RULES_VIVADO_STEP {:s} {:d} {:d}\n'.format(
+          step, rc, round((time.perf_counter() - start) * 1000)).encode())
+      return ''
+
+    # Messages failing the command, other than those white listed.
+    if name == 'rules_vivado_messages':
+      white_list = self._words(self.variables.get('rules_vivado_white_list', '{}')[1:-1])
+      white_listed = sum(self.messages[message_id[1:-1]] for message_id in white_list)
+      return str(sum(self.messages.values()) - white_listed)
+
+    if name == 'get_hw_targets':
+      self._write(' '.join(self.targets).encode() + b'\n')
+      return ''
+
+    if name == 'get_property' and arg.startswith('REGISTER.IR.BIT5_DONE'):
+      self._write(b'0\n' if self.target in self.bad_targets else b'1\n')
+      return ''
+
+    self._apply(command)
+    self._write('INFO: [Fake 1-2] Executed: {:s}\n'.format(command).encode())
+    return ''
+
+  def _apply(self, command):
+    '''Mimic the side effects of commands the client relies on.'''
+    words = command.split()
+
+    if words[0] == 'cd':
+      os.chdir(words[1])
+
+    if words[0] == 'open_hw_target':
+      self.target = words[1] if len(words) > 1 else self.targets[0]
+
+    if words[0] in self.PROGRAMMERS:
+      self._flush()
+      time.sleep(self.program_time)
+      if self.target in self.bad_targets:
+        error = 'ERROR: [Labtools 27-3165] End of startup status: LOW on {:s}\n'.format(
+            self.target).encode()
+        self._message(error)
+        self._write(error)
+
+    # Commands writing an output create it so the client finds its result.
+    if words[0] in self.WRITERS:
+      path = words[words.index('-file') + 1] if '-file' in words else words[-1]
+      with open(path, 'w') as f:
+        f.write(command + '\n')
+
+  def run(self):
+    self._write(PROMPT)
+    self._flush()
+
+    while True:
+      try:
+        data = os.read(sys.stdin.fileno(), 4096)
+      except KeyboardInterrupt:  # At the prompt.
+        continue
+      if not data:
+        return
+
+      # Commands arrive terminated by a carriage return from the client.
+      self.buffer += data.replace(b'\r', b'\n')
+      while True:
+        command, sep, remainder = self.buffer.partition(b'\n')
+        if not sep:
+          break
+
+        self.buffer = remainder
+        command = bytes(command).strip()
+        if command == b'exit':
+          return
+        if command:
+          self._execute(command)
+        self._write(PROMPT)
+        self._flush()
+
+
+def load_script(filename):
+  '''Read a JSON object mapping command names to responses, e.g.
+
+      {"synth_design": {"latency": 30, "output": "synth_design.log", "repeat": 4},
+       "route_design": {"latency": 60, "output_lines": 100000, "line_size": 120}}
+
+  Each response waits `latency` seconds, prints `output_lines` generated lines of `line_size` bytes,
+  then replays the `output` file, recorded from Vivado and relative to the script, `repeat` times.
+  '''
+  with open(filename) as f:
+    script = json.load(f)
+
+  responses = {}
+  for name, entry in script.items():
+    response = {
+        'latency': entry.get('latency', 0.0),
+        'output_lines': entry.get('output_lines', 0),
+        'line_size': entry.get('line_size', 80),
+        'repeat': entry.get('repeat', 1),
+    }
+    if entry.get('output'):
+      with open(os.path.join(os.path.dirname(filename), entry['output']), 'rb') as f:
+        # The terminal turns line feeds into carriage return, line feed pairs as for Vivado.
+        response['output'] = f.read().replace(b'\r\n', b'\n')
+    responses[name] = response
+
+  return responses
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Fake Vivado Tcl shell for testing and benchmarks.')
+  parser.add_argument('--startup', type=float, default=0.0, help='Startup delay [s].')
+  parser.add_argument('--latency', type=float, default=0.0, help='Delay per command [s].')
+  parser.add_argument('--output_lines', type=int, default=0,
+                      help='Number of log lines printed per command.')
+  parser.add_argument('--line_size', type=int, default=80, help='Size of each log line [B].')
+  parser.add_argument('--hw_targets', type=int, default=1,
+                      help='Number of targets on the emulated hardware server.')
+  parser.add_argument('--bad_targets', type=int, default=0,
+                      help='Number of targets, from the last, that fail to program.')
+  parser.add_argument('--program_time', type=float, default=0.0,
+                      help='Time to program a target [s].')
+  parser.add_argument('--script',
+                      help='JSON file of per command latency and output, see load_script.')
+  # Accept and ignore the arguments vivado_server.py passes to Vivado.
+  args, _ = parser.parse_known_args()
+
+  if args.startup:
+    time.sleep(args.startup)
+
+  script = load_script(args.script) if args.script else None
+  FakeVivado(args.latency, args.output_lines, args.line_size, args.hw_targets, args.bad_targets,
+             args.program_time, script).run()
+
+
+if __name__ == '__main__':
+  main()
@@ -1,98 +1,670 @@
 import atexit
+import collections
+import json
 import os
 import psutil
-import select
+import selectors
+import signal
 import socket
 import subprocess
 import sys
 import termios
 import threading
+import time
 import tty
 
 
+def _make_pipe():
+  r, w = os.pipe()
+  os.set_blocking(r, False)
+  os.set_blocking(w, False)
+  return r, w
+
+
+def _signal(fd):
+  try:
+    os.write(fd, b'\0')
+  except BlockingIOError:  # Pipe is full, so it is already readable.
+    pass
+
+
+def _drain(fd):
+  try:
+    while os.read(fd, 1024):
+      pass
+  except BlockingIOError:
+    pass
+
+class RingBuffer:
+  '''Fixed-capacity byte FIFO that is filled and drained through memoryviews.
+
+  One thread may fill the free space while another drains the used space; only the bookkeeping in
+  `commit` and `consume` needs to be serialized by the caller.
+  '''
+
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.data = bytearray(capacity)
+    self.view = memoryview(self.data)
+
+    self.start = 0
+    self.size = 0
+
+  def __len__(self):
+    return self.size
+
+  def free(self):
+    return self.capacity - self.size
+
+  def _segments(self, start, length):
+    first = min(length, self.capacity - start)
+    segments = [self.view[start:start + first]]
+    if length > first:
+      segments.append(self.view[:length - first])
+    return segments
+
+  def writable(self, limit=None):
+    length = self.free() if limit is None else min(self.free(), limit)
+    return self._segments((self.start + self.size) % self.capacity, length)
+
+  def readable(self, limit=None):
+    length = self.size if limit is None else min(self.size, limit)
+    return self._segments(self.start, length)
+
+  def commit(self, length):
+    self.size += length
+
+  def consume(self, length):
+    self.start = (self.start + length) % self.capacity
+    self.size -= length
+
+  def find(self, byte):
+    '''Offset of the first occurrence of a single byte, or -1.'''
+    offset = 0
+    start = self.start
+    for segment in self.readable():
+      index = self.data.find(byte, start, start + len(segment))
+      if index >= 0:
+        return offset + index - start
+      offset += len(segment)
+      start = 0
+    return -1
+
+
+# Starts control lines exchanged between client and server rather than relayed to the process.
+CONTROL_PREFIX = b'%%rules_vivado '
+
+
+# Starts the lines a worker prints to frame the output of a request, followed by the request ID and
+# `begin`, or `end` and the Tcl return code.  The control character never appears in Vivado output.
+FRAME_MARKER = b'\x02rules_vivado '
+
+
+def control_line(command, payload=None):
+  line = CONTROL_PREFIX + command.encode()
+  if payload is not None:
+    line += b' ' + json.dumps(payload).encode()
+  return line
+
+
+def parse_control_line(line):
+  command, _, payload = line[len(CONTROL_PREFIX):].strip().partition(b' ')
+  return command.decode(), json.loads(payload) if payload else None
+
+
+class ProcessPool:
+  # Nothing is known about a worker after an unannounced client used it.
+  UNKNOWN_STATE = {'session': None, 'cwd': None, 'part': None, 'clean': False, 'checkpoint': None}
+
+  def __init__(self, monitors):
+    self.monitors = list(monitors)
+
+    # A freshly started worker has nothing open.
+    self.states = {monitor: dict(self.UNKNOWN_STATE, clean=True) for monitor in self.monitors}
+
+    # Idle workers are handed out with preference to matching state, callers block in FIFO order
+    # when none are idle.
+    self.idle = list(self.monitors)
+    self.waiters = collections.deque()
+    self.condition = threading.Condition()
+
+    # Replacements, and their states, waiting for the worker they replace to become idle.
+    self.replacements = {}
+    # Workers that may exit without stopping the server, such as those being interrupted.
+    self.unwatched = set()
+    # Signaled whenever a worker is replaced or stops being watched.
+    self.changed_r, self.changed_w = _make_pipe()
+
+  def __len__(self):
+    return len(self.monitors)
+
+  def _affinity(self, monitor, session):
+    state = self.states[monitor]
+    checkpoint = session and session.get('checkpoint')
+    return (
+        checkpoint is not None and state['checkpoint'] == checkpoint,
+        session is not None and state['session'] == session.get('session'),
+        session is not None and state['clean'] and state['part'] == session.get('part'),
+        state['clean'],
+    )
+
+  def acquire(self, session=None, cancelled=None, poll=0.2):
+    '''Take an idle worker once all callers waiting before this one have, or return None should
+    `cancelled()`, checked every `poll` seconds, become true first.
+    '''
+    waiter = object()
+    with self.condition:
+      self.waiters.append(waiter)
+
+    try:
+      while True:
+        with self.condition:
+          if self.idle and self.waiters[0] is waiter:
+            monitor = max(self.idle, key=lambda m: self._affinity(m, session))
+            self.idle.remove(monitor)
+            return monitor
+          self.condition.wait(poll)
+
+        # Outside the lock, as checking may stop the pool.
+        if cancelled and cancelled():
+          return None
+    finally:
+      with self.condition:
+        self.waiters.remove(waiter)
+        # The next in line may take any worker still idle.
+        self.condition.notify_all()
+
+  def release(self, monitor):
+    with self.condition:
+      if monitor in self.replacements:
+        monitor = self._swap(monitor)
+      self.idle.append(monitor)
+      # Only the first in line takes it, and waiters do not know who that is.
+      self.condition.notify_all()
+
+  def _swap(self, monitor):
+    replacement, state = self.replacements.pop(monitor)
+    self.monitors[self.monitors.index(monitor)] = replacement
+    del self.states[monitor]
+    self.states[replacement] = state
+    self.unwatched.discard(monitor)
+    _signal(self.changed_w)
+
+    threading.Thread(target=monitor.close, daemon=True).start()
+    return replacement
+
+  def replace(self, monitor, replacement, state):
+    '''Put a running replacement in the place of a worker, which is closed, once it is idle.'''
+    with self.condition:
+      self.replacements[monitor] = (replacement, state)
+      if monitor in self.idle:
+        self.idle[self.idle.index(monitor)] = self._swap(monitor)
+
+  def swap(self, monitor, replacement, state):
+    '''Put a running replacement in the place of a worker the caller holds, which is closed.  The
+    caller then holds the replacement.
+    '''
+    with self.condition:
+      self.replacements[monitor] = (replacement, state)
+      self._swap(monitor)
+
+  def unwatch(self, monitor):
+    with self.condition:
+      self.unwatched.add(monitor)
+    _signal(self.changed_w)
+
+  def watch(self, monitor):
+    with self.condition:
+      self.unwatched.discard(monitor)
+    _signal(self.changed_w)
+
+  def watched(self):
+    with self.condition:
+      return [monitor for monitor in self.monitors if monitor not in self.unwatched]
+
+  def busy(self):
+    '''Number of workers handed out, whether serving a client or being reset.'''
+    with self.condition:
+      return len(self.monitors) - len(self.idle)
+
+  def index(self, monitor):
+    return self.monitors.index(monitor)
+
+  def run(self):
+    for monitor in self.monitors:
+      monitor.run()
+
+  def stop(self):
+    for monitor in self.monitors:
+      monitor.stop()
+
+  def is_alive(self):
+    return all(monitor.is_alive() for monitor in self.watched())
+
+
 class ProcessServer:
-  def __init__(self, monitor, host='localhost', port=9191):
-    self.monitor = monitor
+  '''Relays client connections to idle workers in a ProcessPool.
+
+  Clients may announce sessions with control lines, each carrying a session ID, part and the hash of
+  a checkpoint to open.  Sessions are routed to workers whose state already matches, which is
+  reported back so the client can skip redundant setup.  A `cwd` control line records the directory
+  the worker changed to once it has, so later sessions in that directory need not change to it.  A
+  `design` control line records the hash of the checkpoint whose design the worker holds open, until
+  any further Tcl in the session, so the next session opening that checkpoint can use the design in
+  memory instead.
+  A connection may run several sessions one after another, releasing its worker between them.  A
+  `status` control line is answered with the number of workers, how many are idle and how many
+  connections wait for one, for clients balancing load between servers.  After a session the
+  optional `reset(monitor, state)` callback prepares the idle worker for the next one and returns
+  whether it left the worker clean.
+
+  Within a session, a `run` control line carries a request ID and script.  The `frame(request_id,
+  script)` callback turns it into input for the worker that prints the script's output between
+  `FRAME_MARKER` lines.  Only that output is relayed, dropping echoed input and prompts, and
+  followed by a `done` control line with the return code, so clients need not recognize the end
+  of a response themselves.
+
+  Each line a session sends to the worker is passed through the optional `prepare(monitor, line)`
+  callback, which returns the line to send, e.g. with commands adjusting the worker's settings
+  prepended.
+
+  Once idle after a session, a worker for which the optional `recycle(monitor)` callback returns
+  true is replaced by a new process.  The worker keeps serving clients while its replacement starts
+  in the background, and the replacement takes its place the next time both are idle.  The
+  replacement is prepared with `reset`, which also waits for it to start.
+
+  Should a client disconnect while its request is running, the worker is interrupted with SIGINT,
+  as Ctrl-C would in a terminal.  A worker that has not finished the request `cancel_timeout`
+  seconds later is killed and replaced by a new process.  Either way the worker is reset before its
+  next client.
+  '''
+
+  def __init__(self, pool, host='localhost', port=9191, reset=None, prepare=None, frame=None,
+               recycle=None, cancel_timeout=10.0):
+    self.pool = pool
     self.host = host
     self.port = port
+    self.reset = reset
+    self.prepare = prepare
+    self.frame = frame
+    self.recycle = recycle
+    self.cancel_timeout = cancel_timeout
+
+    # Connections waiting in line for an idle worker.
+    self.waiting = 0
+    self.waiting_lock = threading.Lock()
 
     self.should_run_event = threading.Event()
+    self.listening = threading.Event()
+
+    # Never drained once signaled, so every waiting selector wakes on stop.
+    self.stop_r, self.stop_w = _make_pipe()
 
   def _should_run(self):
-    # Make sure monitor is still healthy and exit if not.
-    if not self.monitor.is_alive():
-      self.monitor.stop()
+    if not self.should_run_event.is_set():
+      return False
+
+    # Make sure all workers are still healthy and exit if not.
+    if not self.pool.is_alive():
+      self.pool.stop()
       print('\r\nPROCESS SERVER: Monitor exited.\r\n', end='')
       return False
 
-    return self.should_run_event.is_set()
+    return True
 
   def _server_thread(self):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-      # Setup non-blocking, reusing port, with only one allowed pending connection.
-      s.settimeout(0.2)
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s, \
+         selectors.DefaultSelector() as selector:
+      # Setup non-blocking, reusing port, with connections waiting for an idle worker.
+      s.setblocking(False)
       s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
       s.bind((self.host, self.port))
-      s.listen(1)
+      s.listen(socket.SOMAXCONN)
+      self.listening.set()
+
+      # Wake on new connections, server stop, any watched worker exiting, or the workers changing.
+      selector.register(s, selectors.EVENT_READ)
+      selector.register(self.stop_r, selectors.EVENT_READ)
+      selector.register(self.pool.changed_r, selectors.EVENT_READ)
+      exits = set()
 
       while self._should_run():
+        _drain(self.pool.changed_r)
+        current = {monitor.exit_fileno() for monitor in self.pool.watched()}
+        for fd in exits - current:
+          selector.unregister(fd)
+        for fd in current - exits:
+          selector.register(fd, selectors.EVENT_READ)
+        exits = current
+
+        selector.select()
+
         try:
           conn, addr = s.accept()
-        except socket.timeout:
+        except BlockingIOError:
+          continue
+
+        # Relay small prompts immediately rather than waiting on delayed ACKs.
+        conn.setblocking(True)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=self._connection_thread, args=(conn, addr), daemon=True).start()
+
+  def _connection_thread(self, conn, addr):
+    with conn:
+      self._serve_connection(conn, addr)
+
+  def status(self):
+    with self.waiting_lock:
+      waiting = self.waiting
+    return {'workers': len(self.pool), 'idle': len(self.pool) - self.pool.busy(),
+            'waiting': waiting}
+
+  def _begin(self, selector, addr, session=None):
+    # Wait in line for an idle worker.
+    with self.waiting_lock:
+      self.waiting += 1
+    try:
+      monitor = self.pool.acquire(session, lambda: not self._should_run())
+      if monitor is None:
+        return None
+    finally:
+      with self.waiting_lock:
+        self.waiting -= 1
+
+    print('\r\nPROCESS SERVER: Connected to {} on worker {:d}.\r\n'.format(
+        addr, self.pool.index(monitor)), end='')
+
+    # Discard data from before connection.
+    monitor.attach()
+
+    selector.register(monitor, selectors.EVENT_READ)
+    selector.register(monitor.exit_fileno(), selectors.EVENT_READ)
+    return monitor
+
+  def _end(self, selector, monitor, session=None, cwd=None, design=None, request=None):
+    selector.unregister(monitor)
+    selector.unregister(monitor.exit_fileno())
+    replaced = False
+    if request and self.should_run_event.is_set():
+      monitor, replaced = self._cancel(monitor, request)
+    monitor.detach()
+    monitor.jobs += 1
+
+    # A replacement is in the server's directory with nothing open, whatever the session did.
+    if session is None or replaced:
+      self.pool.states[monitor] = dict(self.pool.UNKNOWN_STATE)
+      self._recycle(monitor)
+      self.pool.release(monitor)
+      return
+
+    state = dict(self.pool.UNKNOWN_STATE, session=session.get('session'), cwd=cwd,
+                 part=session.get('part'), checkpoint=design)
+    self.pool.states[monitor] = state
+
+    # Resetting would close a design kept open for the next session.
+    if self.reset and state['part'] and not design and self.should_run_event.is_set():
+      threading.Thread(target=self._reset_thread, args=(monitor, state), daemon=True).start()
+    else:
+      self._recycle(monitor)
+      self.pool.release(monitor)
+
+  def _reset_thread(self, monitor, state):
+    try:
+      state['clean'] = bool(self.reset(monitor, state))
+      # After closing the design, so only memory Vivado holds on to counts.
+      self._recycle(monitor)
+    finally:
+      self.pool.release(monitor)
+
+  def _recycle(self, monitor):
+    if not self.recycle or monitor.retiring or not self.should_run_event.is_set():
+      return
+    if not self.recycle(monitor):
+      return
+
+    monitor.retiring = True
+    print('\r\nPROCESS SERVER: Replacing worker {:d} using {:.1f} GB after {:d} sessions.\r\n'
+          .format(self.pool.index(monitor), monitor.rss() / 1024**3, monitor.jobs), end='')
+    threading.Thread(target=self._replace_thread, args=(monitor,), daemon=True).start()
+
+  def _replace_thread(self, monitor):
+    replacement = monitor.replacement()
+    # A new worker has nothing open, and is set to the same part.
+    state = dict(self.pool.UNKNOWN_STATE, part=self.pool.states[monitor]['part'], clean=True)
+    try:
+      replacement.run()
+      if self.reset:
+        state['clean'] = bool(self.reset(replacement, state))
+    except OSError as e:
+      print('\r\nPROCESS SERVER: Could not start replacement: {}\r\n'.format(e), end='')
+
+    if not replacement.is_alive() or not self.should_run_event.is_set():
+      # Try again after the next session.
+      replacement.close()
+      monitor.retiring = False
+      return
+
+    self.pool.replace(monitor, replacement, state)
+
+  def _cancel(self, monitor, request):
+    '''Interrupt the request of a client that went away, returning the worker to carry on with and
+    whether it is a new process replacing one that did not stop.
+    '''
+    end = FRAME_MARKER + str(request['id']).encode() + b' end '
+    if self._skip_request(monitor, end, 0):
+      return monitor, False
+
+    index = self.pool.index(monitor)
+    print('\r\nPROCESS SERVER: Interrupting worker {:d}.\r\n'.format(index), end='')
+    # Vivado may exit rather than be interrupted, which must not stop the server.
+    self.pool.unwatch(monitor)
+    monitor.interrupt()
+    if self._skip_request(monitor, end, self.cancel_timeout):
+      self.pool.watch(monitor)
+      return monitor, False
+
+    print('\r\nPROCESS SERVER: Replacing worker {:d}, which did not stop.\r\n'.format(index),
+          end='')
+    replacement = monitor.replacement()
+    replacement.run()
+    self.pool.swap(monitor, replacement, dict(self.pool.UNKNOWN_STATE))
+    replacement.attach()
+    return replacement, True
+
+  def _skip_request(self, monitor, end, timeout):
+    '''Discard output up to the `end` marker of a request, returning whether it arrived in time.'''
+    deadline = time.monotonic() + timeout
+    with selectors.DefaultSelector() as selector:
+      selector.register(monitor, selectors.EVENT_READ)
+      selector.register(monitor.exit_fileno(), selectors.EVENT_READ)
+
+      while True:
+        index = monitor.find(FRAME_MARKER[:1])
+        monitor.discard(None if index < 0 else index)
+        line = index >= 0 and monitor.read_line()
+        if line:
+          if line.startswith(end):
+            return True
           continue
 
-        with conn:
-          print('\r\nPROCESS SERVER: Connected to {}.\r\n'.format(addr), end='')
-          conn.settimeout(0.2)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not monitor.is_alive():
+          return False
+        selector.select(remaining)
+
+  def _relay_request(self, monitor, conn, request):
+    '''Relay the output of a request between its markers, returning None once it has completed.'''
+    prefix = FRAME_MARKER + str(request['id']).encode()
+    while True:
+      index = monitor.find(FRAME_MARKER[:1])
+
+      # Echoed input and prompts precede the begin marker.
+      if not request['started']:
+        monitor.discard(None if index < 0 else index)
+        line = index >= 0 and monitor.read_line()
+        if not line:
+          return request
+        request['started'] = line.rstrip() == prefix + b' begin'
+        monitor.last_sent = b'\n'
+        continue
 
-          # Discard data from before connection.
-          self.monitor.read()
+      if index != 0:
+        monitor.send(conn, None if index < 0 else index)
+        if index < 0:
+          return request
+        continue
 
-          # Continually interact with connection.
-          while self._should_run():
-            connection_closed = False
+      line = monitor.read_line()
+      if not line:
+        return request
+      if not line.startswith(prefix + b' end '):
+        conn.sendall(line)
+        continue
 
-            try:
-              rx_data = conn.recv(1024)
-              if not rx_data:  # Empty receive indicates closed connection.
+      # The done line starts a line of its own even if the output did not end one.
+      done = control_line('done', {'id': request['id'], 'rc': int(line.split()[-1])}) + b'\n'
+      conn.sendall(done if monitor.last_sent == b'\n' else b'\n' + done)
+      return None
+
+  def _serve_connection(self, conn, addr):
+    monitor = None
+    session = None
+    # Whether the client announces sessions, which is unknown until it first sends data.
+    sessions = None
+    pending = bytearray()
+    # Whether the client frames requests, and the request whose output is being relayed.
+    framed = False
+    request = None
+    # Directory the worker is known to be in, and hash of the checkpoint whose design it holds open,
+    # as declared by the client.
+    cwd = None
+    design = None
+
+    with selectors.DefaultSelector() as selector:
+      selector.register(conn, selectors.EVENT_READ)
+      selector.register(self.stop_r, selectors.EVENT_READ)
+
+      try:
+        # Relay data in either direction as soon as it is available.
+        while self._should_run():
+          connection_closed = False
+
+          for key, _ in selector.select():
+            if key.fileobj is conn:
+              try:
+                rx_data = conn.recv(4096)
+                if not rx_data:  # Empty receive indicates closed connection.
+                  connection_closed = True
+              except OSError:
+                rx_data = b''
                 connection_closed = True
-            except socket.timeout:
-              rx_data = b''
-            except OSError:
-              rx_data = b''
-              connection_closed = True
 
-            if rx_data:
-              self.monitor.write(rx_data)
+              pending += rx_data
 
-            tx_data = self.monitor.read()
-            if tx_data:
+            elif key.fileobj is monitor:
               try:
-                conn.sendall(tx_data)
+                if request:
+                  request = self._relay_request(monitor, conn, request)
+                elif framed:
+                  # Prompts following a request's output.
+                  monitor.discard()
+                else:
+                  monitor.send(conn)
               except OSError:
                 connection_closed = True
 
-            if connection_closed:
-              print('\r\nPROCESS SERVER: Connection closed.\r\n', end='')
+          if sessions is None and pending:
+            sessions = pending.startswith(CONTROL_PREFIX)
+            if not sessions:
+              monitor = self._begin(selector, addr)
+              if not monitor:
+                return
+
+          if not sessions:
+            if pending:
+              monitor.write(pending)
+              pending = bytearray()
+
+          # Complete lines are either control lines or Tcl for the current session's worker.
+          while sessions:
+            line, sep, remainder = pending.partition(b'\r')
+            if not sep:
               break
-
+            pending = remainder
+
+            if not line.startswith(CONTROL_PREFIX):
+              design = None
+              if monitor:
+                if self.prepare:
+                  line = self.prepare(monitor, line)
+                monitor.write(line + sep)
+              continue
+
+            command, payload = parse_control_line(line)
+            if command == 'status':
+              conn.sendall(control_line('status', self.status()) + b'\n')
+              continue
+
+            if command == 'cwd':
+              cwd = payload['cwd']
+              continue
+
+            if command == 'design':
+              design = payload['checkpoint']
+              continue
+
+            if command == 'run':
+              framed = True
+              design = None
+              if not monitor or not self.frame:
+                conn.sendall(control_line('done', {'id': payload['id'], 'rc': -1}) + b'\n')
+                continue
+
+              request = {'id': payload['id'], 'started': False}
+              line = self.frame(payload['id'], payload['script'])
+              if self.prepare:
+                line = self.prepare(monitor, line)
+              monitor.write(line + b'\r')
+              continue
+
+            if monitor:
+              self._end(selector, monitor, session, cwd, design)
+              monitor = None
+              design = None
+
+            if command == 'session':
+              session = payload
+              monitor = self._begin(selector, addr, session)
+              if not monitor:
+                return
+              # Only changed by a session that reports changing directory.
+              cwd = self.pool.states[monitor]['cwd']
+              conn.sendall(control_line('state', self.pool.states[monitor]) + b'\n')
+
+          if connection_closed:
+            print('\r\nPROCESS SERVER: Connection closed.\r\n', end='')
+            break
+      finally:
+        if monitor:
+          self._end(selector, monitor, session, cwd, design, request)
 
   def _stop_server_thread(self):
     self.should_run_event.clear()
+    _signal(self.stop_w)
     self.server_thread.join(1.0)
     if self.server_thread.is_alive():
       raise Exception('Could not stop thread.')
 
   def run(self):
-    self.monitor.run()
+    self.pool.run()
 
     self.should_run_event.set()
     self.server_thread = threading.Thread(target=self._server_thread, daemon=True)
     self.server_thread.start()
 
   def stop(self):
-    self.monitor.stop()
     self._stop_server_thread()
+    self.pool.stop()
 
   def serve_forever(self):
     self.run()
@@ -103,60 +675,121 @@ class ProcessServer:
 
 
 class ProcessMonitor:
-  def __init__(self, args, tee_stdin=False, tee_stdout=False, raw_mode=False):
+  def __init__(self, args, tee_stdin=False, tee_stdout=False, raw_mode=False,
+               buffer_size=16 * 1024 * 1024, read_size=1024 * 1024):
     self.args = args
     self.tee_stdin = tee_stdin
     self.tee_stdout = tee_stdout
     self.raw_mode = raw_mode
+    self.read_size = read_size
 
     self.should_run = threading.Event()
+    self.exited = threading.Event()
+    # Output is only buffered while a consumer is attached, otherwise it is dropped.
+    self.attached = threading.Event()
 
     self.buffer_lock = threading.Lock()
     self.buffer_ready = threading.Event()
-    self.buffer = bytearray()
+    self.buffer = RingBuffer(buffer_size)
+
+    # Readable while the buffer holds data, for use with selectors.
+    self.ready_r, self.ready_w = _make_pipe()
+    # Wakes the polling thread to stop or notice process exit.
+    self.wake_r, self.wake_w = _make_pipe()
+    # Closed, and so permanently readable, once the monitor exits.
+    self.exit_r, self.exit_w = _make_pipe()
 
     self.process = None
     self.polling_thread = None
+    self.wait_thread = None
+
+    # Last byte of output sent to a client.
+    self.last_sent = b'\n'
+
+    # Sessions served, and whether a replacement is being started, for recycling workers.
+    self.jobs = 0
+    self.retiring = False
 
     # Save terminal settings to revert to if necessary.
-    self.termios_settings = termios.tcgetattr(sys.stdin.fileno())
+    self.termios_settings = None
+    if self.raw_mode:
+      self.termios_settings = termios.tcgetattr(sys.stdin.fileno())
 
   def _enter_raw_mode(self):
     tty.setraw(sys.stdin.fileno())
 
   def _exit_raw_mode(self):
+    if self.termios_settings is None:
+      return
     termios.tcsetattr(sys.stdin.fileno(), termios.TCSADRAIN, self.termios_settings)
 
   def _polling_thread(self):
-    read_list = [self.out_r]
-    if self.tee_stdin:
-      read_list.append(sys.stdin.fileno())
-
-    while self.should_run.is_set():
-      ready_list, _, _ = select.select(read_list, [], [], 0.2)
-      # Continue on timeout.
-      if not ready_list:
-        continue
+    try:
+      self._poll()
+    finally:
+      self.exited.set()
+      os.close(self.exit_w)
+
+  def _poll(self):
+    with selectors.DefaultSelector() as selector:
+      selector.register(self.wake_r, selectors.EVENT_READ)
+      if self.tee_stdin:
+        selector.register(sys.stdin.fileno(), selectors.EVENT_READ)
+
+      reading = False
+      while self.should_run.is_set() and self.process.poll() is None:
+        # Apply backpressure to the process while the consumer catches up.
+        with self.buffer_lock:
+          has_space = self.buffer.free() > 0
+        if has_space != reading:
+          if has_space:
+            selector.register(self.out_r, selectors.EVENT_READ)
+          else:
+            selector.unregister(self.out_r)
+          reading = has_space
+
+        for key, _ in selector.select():
+          if key.fd == self.wake_r:
+            _drain(self.wake_r)
+          elif key.fd == self.out_r:
+            if not self._read_output():
+              return
+          else:
+            stdin_bytes = os.read(sys.stdin.fileno(), 1024)
+            if stdin_bytes:
+              os.write(self.in_w, stdin_bytes)
+
+  def _read_output(self):
+    # Read straight into free space, which the consumer never touches.
+    with self.buffer_lock:
+      segments = self.buffer.writable(self.read_size)
+
+    try:
+      size = os.readv(self.out_r, segments)
+    except OSError:  # Terminal hung up.
+      return False
 
-      stdin_bytes = b''
-      stdout_bytes = b''
+    if not size:
+      return False
 
-      for fd in ready_list:
-        if fd == sys.stdin.fileno():
-          stdin_bytes = os.read(sys.stdin.fileno(), 1024)
-        if fd == self.out_r:
-          stdout_bytes = os.read(self.out_r, 1024)
+    if self.tee_stdout:
+      remaining = size
+      for segment in segments:
+        os.write(sys.stdout.fileno(), segment[:remaining])
+        remaining -= min(remaining, len(segment))
 
-      if stdin_bytes and self.tee_stdin:
-        os.write(self.in_w, stdin_bytes)
+    with self.buffer_lock:
+      if self.attached.is_set():
+        if not self.buffer:
+          _signal(self.ready_w)
+        self.buffer.commit(size)
+        self.buffer_ready.set()
 
-      if stdout_bytes and self.tee_stdout:
-        os.write(sys.stdout.fileno(), stdout_bytes)
+    return True
 
-      if stdout_bytes:
-        with self.buffer_lock:
-          self.buffer.extend(stdout_bytes)
-          self.buffer_ready.set()
+  def _wait_thread(self):
+    self.process.wait()
+    _signal(self.wake_w)
 
   def _stop_polling_thread(self):
     self.should_run.clear()
@@ -165,29 +798,110 @@ class ProcessMonitor:
     if not self.polling_thread:
       return
 
+    _signal(self.wake_w)
     self.polling_thread.join(1.0)
     if self.polling_thread.is_alive():
       raise Exception('Could not stop thread.')
 
+  def fileno(self):
+    return self.ready_r
+
+  def exit_fileno(self):
+    return self.exit_r
+
+  def _consume(self, size):
+    with self.buffer_lock:
+      was_full = self.buffer.free() == 0
+      self.buffer.consume(size)
+
+      if not self.buffer:
+        self.buffer_ready.clear()
+        _drain(self.ready_r)
+
+      # Resume reading from the process.
+      if was_full and size:
+        _signal(self.wake_w)
+
+  def attach(self):
+    with self.buffer_lock:
+      self.attached.set()
+      size = len(self.buffer)
+    self._consume(size)
+
+  def detach(self):
+    with self.buffer_lock:
+      self.attached.clear()
+      size = len(self.buffer)
+    self._consume(size)
+
   def read(self):
     with self.buffer_lock:
-      buffer_bytes = bytes(self.buffer)
-      self.buffer = bytearray()
-      self.buffer_ready.clear()
-      return buffer_bytes
+      buffer_bytes = b''.join(self.buffer.readable())
+    self._consume(len(buffer_bytes))
+    return buffer_bytes
 
   def read_line(self):
     with self.buffer_lock:
-      line, sep, remainder = self.buffer.partition(b'\n')
-
-      if not sep:
+      index = self.buffer.find(b'\n')
+      if index < 0:
         return b''
+      line = b''.join(self.buffer.readable(index + 1))
+    self._consume(len(line))
+    return line
+
+  def execute(self, data, done, timeout=None):
+    '''Write data with no client attached and collect output until `done(output)` is true.
+
+    Returns the output, or None if the process exited or the timeout expired first.
+    '''
+    self.attach()
+    try:
+      self.write(data)
+
+      output = bytearray()
+      deadline = None if timeout is None else time.monotonic() + timeout
+      with selectors.DefaultSelector() as selector:
+        selector.register(self, selectors.EVENT_READ)
+        selector.register(self.exit_r, selectors.EVENT_READ)
+
+        while not done(output):
+          remaining = None if deadline is None else max(0, deadline - time.monotonic())
+          if not selector.select(remaining) or not self.is_alive():
+            return None
+          output += self.read()
+
+      return bytes(output)
+    finally:
+      self.detach()
+
+  def find(self, byte):
+    '''Offset of a single byte in the buffered output, or -1.'''
+    with self.buffer_lock:
+      return self.buffer.find(byte)
 
-      self.buffer = remainder
-      if not self.buffer:
-        self.buffer_ready.clear()
+  def discard(self, size=None):
+    '''Drop `size` bytes of buffered output, or all of it.'''
+    with self.buffer_lock:
+      size = len(self.buffer) if size is None else min(size, len(self.buffer))
+    self._consume(size)
 
-      return bytes(line + sep)
+  def send(self, sock, limit=None):
+    '''Send buffered output, up to `limit` bytes, to a socket without copying it, returning the bytes
+    sent.
+    '''
+    with self.buffer_lock:
+      segments = [segment for segment in self.buffer.readable(limit) if segment]
+
+    sent = 0
+    try:
+      for segment in segments:
+        sock.sendall(segment)
+        sent += len(segment)
+        self.last_sent = bytes(segment[-1:])
+    finally:
+      self._consume(sent)
+
+    return sent
 
   def write(self, data):
     os.write(self.in_w, data)
@@ -212,14 +926,19 @@ class ProcessMonitor:
     self.should_run.set()
     self.polling_thread = threading.Thread(target=self._polling_thread, daemon=True)
     self.polling_thread.start()
+    self.wait_thread = threading.Thread(target=self._wait_thread, daemon=True)
+    self.wait_thread.start()
 
   def _terminate_processes(self):
     # Only proceed if process is still running.
     if not self.process or self.process.poll() is not None:
       return
 
-    parent = psutil.Process(self.process.pid)
-    children = parent.children(recursive=True)
+    try:
+      parent = psutil.Process(self.process.pid)
+      children = parent.children(recursive=True)
+    except psutil.NoSuchProcess:  # Exited since polling.
+      return
     procs = children + [parent]
 
     for p in procs:
@@ -230,10 +949,51 @@ class ProcessMonitor:
     for p in alive:
       p.kill()
 
+  def interrupt(self):
+    '''Send SIGINT to the process and its children, as Ctrl-C would to a job in a terminal.'''
+    try:
+      parent = psutil.Process(self.process.pid)
+      procs = [parent] + parent.children(recursive=True)
+    except psutil.NoSuchProcess:
+      return
+
+    for p in procs:
+      try:
+        p.send_signal(signal.SIGINT)
+      except psutil.NoSuchProcess:
+        pass
+
+  def rss(self):
+    '''Resident memory of the process and its children [B].'''
+    try:
+      parent = psutil.Process(self.process.pid)
+      procs = [parent] + parent.children(recursive=True)
+      return sum(p.memory_info().rss for p in procs)
+    except psutil.NoSuchProcess:  # Exited, or a child exited while measuring.
+      return 0
+
+  def replacement(self):
+    '''A new monitor for the same command, not attached to the terminal.'''
+    return ProcessMonitor(self.args, tee_stdout=self.tee_stdout,
+                          buffer_size=self.buffer.capacity, read_size=self.read_size)
+
   def is_alive(self):
-    return self.process.poll() is None and self.polling_thread.is_alive()
+    return bool(self.process) and self.process.poll() is None and not self.exited.is_set()
 
   def stop(self):
     self._terminate_processes()
     self._stop_polling_thread()
     self._exit_raw_mode()
+
+  def close(self):
+    '''Stop for good, e.g. once replaced, releasing the terminals and pipes.'''
+    atexit.unregister(self.stop)
+    self.stop()
+
+    fds = [self.ready_r, self.ready_w, self.wake_r, self.wake_w, self.exit_r]
+    if self.process:
+      # The wait thread signals the wake pipe as the process exits.
+      self.wait_thread.join()
+      fds += [self.in_r, self.in_w, self.out_r, self.out_w]
+    for fd in fds:
+      os.close(fd)
@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import os.path
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import process_manager
+import vivado_client
+import vivado_server
+
+
+FAKE_VIVADO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_vivado.py')
+PART = 'xc7a35ticsg324-1l'
+
+# Runs fake Vivado with SIGINT ignored, as a Vivado stuck in a command would ignore it.
+IGNORE_SIGINT = ('import runpy, signal, sys; signal.signal(signal.SIGINT, signal.SIG_IGN); '
+                 'sys.argv = sys.argv[1:]; runpy.run_path(sys.argv[0], run_name="__main__")')
+
+
+def setUpModule():
+  # Workers are interrupted with SIGINT, which they would inherit ignoring from a test run in the
+  # background by a script.
+  signal.signal(signal.SIGINT, signal.default_int_handler)
+
+
+def free_port():
+  with socket.socket() as s:
+    s.bind(('localhost', 0))
+    return s.getsockname()[1]
+
+
+def wait_for(condition, timeout=10.0):
+  '''Poll until `condition()` holds, returning whether it did before the timeout.'''
+  deadline = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() > deadline:
+      return False
+    time.sleep(0.05)
+  return True
+
+
+class ProcessPoolTest(unittest.TestCase):
+
+  def setUp(self):
+    self.pool = process_manager.ProcessPool(['worker'])
+    self.held = self.pool.acquire()
+
+  def wait_in_line(self, taken, name, release=True):
+    '''Start a caller waiting for the worker, which records its name once it takes it.'''
+    def wait():
+      monitor = self.pool.acquire(poll=0.01)
+      taken.append(name)
+      if release:
+        self.pool.release(monitor)
+
+    waiters = len(self.pool.waiters)
+    thread = threading.Thread(target=wait)
+    thread.start()
+    self.assertTrue(wait_for(lambda: len(self.pool.waiters) > waiters))
+    return thread
+
+  def test_first_in_line_served_first(self):
+    taken = []
+    threads = [self.wait_in_line(taken, i) for i in range(3)]
+
+    self.pool.release(self.held)
+    for thread in threads:
+      thread.join(5)
+    self.assertEqual(taken, [0, 1, 2])
+
+  def test_later_arrival_waits_its_turn(self):
+    taken = []
+    thread = self.wait_in_line(taken, 'first', release=False)
+
+    # Arriving as the worker is released, and giving up once the one waiting has taken it.
+    self.pool.release(self.held)
+    self.assertIsNone(self.pool.acquire(cancelled=lambda: bool(taken), poll=0.01))
+    thread.join(5)
+    self.assertEqual(taken, ['first'])
+
+
+class ServerTest(unittest.TestCase):
+  '''Serves a single fake Vivado worker routing for longer than any test waits.'''
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+
+    self.script = os.path.join(self.directory.name, 'script.json')
+    with open(self.script, 'w') as f:
+      json.dump({'route_design': {'latency': 30}}, f)
+
+  def start_server(self, args, **kwargs):
+    monitor = process_manager.ProcessMonitor(args + ['--script', self.script])
+    self.server = process_manager.ProcessServer(
+        process_manager.ProcessPool([monitor]), port=free_port(), reset=vivado_server.reset_worker,
+        frame=vivado_server.frame_request, **kwargs)
+    self.server.run()
+    self.server.listening.wait()
+    self.addCleanup(self.server.stop)
+
+  def connect(self):
+    client = vivado_client.VivadoClient('localhost', self.server.port, False)
+    self.addCleanup(client.close)
+    return client
+
+  def worker(self):
+    return self.server.pool.monitors[0]
+
+  def assert_served(self, timeout):
+    '''A new client gets a worker and its command completes within `timeout` seconds.'''
+    start = time.monotonic()
+    with self.connect() as client:
+      client.begin_session(None, PART)
+      client.set_part(PART)
+      client.end_session()
+    self.assertLess(time.monotonic() - start, timeout)
+
+  def route_and_disconnect(self):
+    '''Leave a request routing on the worker, as a client killed mid command would.'''
+    client = self.connect()
+    vivado_client.open_session(client, argparse.Namespace(session=None, part=PART, input=None))
+    client._request(b'route_design')
+    # Let the worker start routing.
+    time.sleep(0.5)
+    client.close()
+
+
+class SessionStateTest(ServerTest):
+
+  def test_directory_recorded_once_entered(self):
+    self.start_server([sys.executable, FAKE_VIVADO])
+    args = argparse.Namespace(session=None, part=PART, input=None)
+
+    # A session announced and abandoned before changing directory, as a cancelled action is.
+    client = self.connect()
+    client.begin_session(None, PART)
+    client.close()
+
+    with self.connect() as client:
+      vivado_client.open_session(client, args)
+      self.assertIsNone(client.state['cwd'])
+      client.end_session()
+
+      vivado_client.open_session(client, args)
+      self.assertEqual(client.state['cwd'], os.getcwd())
+      client.end_session()
+
+
+class RecycleTest(ServerTest):
+
+  def test_replaced_after_max_jobs(self):
+    self.start_server([sys.executable, FAKE_VIVADO], recycle=vivado_server.RecyclePolicy(0, 2))
+    worker = self.worker()
+
+    with self.connect() as client:
+      for _ in range(2):
+        client.begin_session(None, PART)
+        client.set_part(PART)
+        client.end_session()
+
+    # The replacement takes the idle worker's place, which then exits.
+    self.assertTrue(wait_for(lambda: self.worker() is not worker))
+    self.assertTrue(wait_for(lambda: worker.process.poll() is not None))
+    self.assertTrue(self.worker().is_alive())
+    self.assertTrue(self.server.is_alive())
+    self.assert_served(5)
+
+
+class CancelTest(ServerTest):
+
+  def test_interrupt_keeps_worker(self):
+    self.start_server([sys.executable, FAKE_VIVADO])
+    pid = self.worker().process.pid
+
+    self.route_and_disconnect()
+
+    # Served long before routing would have finished, by the same interrupted process.
+    self.assert_served(5)
+    self.assertEqual(self.worker().process.pid, pid)
+
+  def test_kill_and_replace(self):
+    self.start_server([sys.executable, '-c', IGNORE_SIGINT, FAKE_VIVADO], cancel_timeout=1)
+    worker = self.worker()
+
+    self.route_and_disconnect()
+
+    # The new process is in the server's directory, so the next client must change directory.
+    self.assertTrue(wait_for(lambda: self.worker() is not worker and self.server.status()['idle']))
+    self.assertIsNone(self.server.pool.states[self.worker()]['cwd'])
+
+    self.assert_served(10)
+    self.assertIsNot(self.worker(), worker)
+    self.assertNotEqual(self.worker().process.pid, worker.process.pid)
+    self.assertTrue(wait_for(lambda: worker.process.poll() is not None))
+    self.assertTrue(self.server.is_alive())
+
+
+if __name__ == '__main__':
+  unittest.main()
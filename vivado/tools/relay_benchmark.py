@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import os.path
+import statistics
+import sys
+import time
+
+import process_manager
+import vivado_client
+import vivado_server
+
+
+FAKE_VIVADO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_vivado.py')
+
+
+def fake_vivado_args(*args):
+  return [sys.executable, FAKE_VIVADO] + list(args)
+
+
+def measure_latency(client, commands):
+  latencies = []
+  for _ in range(commands):
+    start = time.perf_counter()
+    client.set_part('xc7a35ticsg324-1l')
+    latencies.append(time.perf_counter() - start)
+
+  return latencies
+
+
+def measure_batch(client, commands):
+  '''Time the same commands sent as a single batch, returning the time per command.'''
+  start = time.perf_counter()
+  with client.batch():
+    for _ in range(commands):
+      client.set_part('xc7a35ticsg324-1l')
+  return (time.perf_counter() - start) / commands
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Measure per-command relay latency of the server.')
+  parser.add_argument('--commands', type=int, default=50, help='Number of round trips.')
+  parser.add_argument('--port', type=int, default=9192, help='A port number for connection.')
+  args = parser.parse_args()
+
+  monitor = process_manager.ProcessMonitor(fake_vivado_args())
+  server = process_manager.ProcessServer(process_manager.ProcessPool([monitor]), port=args.port,
+                                         frame=vivado_server.frame_request)
+  server.run()
+  server.listening.wait()
+
+  try:
+    with vivado_client.VivadoClient('localhost', args.port, False) as client:
+      # Prime the connection so startup is not measured.
+      client.begin_session(None, None)
+      client.change_directory(os.getcwd())
+      latencies = measure_latency(client, args.commands)
+      batched = measure_batch(client, args.commands)
+  finally:
+    server.stop()
+
+  latencies = sorted(l * 1e3 for l in latencies)
+  print('\nRelay latency over {:d} commands [ms]:'.format(len(latencies)))
+  print('  mean:   {:8.3f}'.format(statistics.mean(latencies)))
+  print('  median: {:8.3f}'.format(statistics.median(latencies)))
+  print('  p95:    {:8.3f}'.format(latencies[int(0.95 * (len(latencies) - 1))]))
+  print('  max:    {:8.3f}'.format(latencies[-1]))
+  print('  batched:{:8.3f}'.format(batched * 1e3))
+
+
+if __name__ == '__main__':
+  main()
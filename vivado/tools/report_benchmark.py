@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+import report_parser
+
+
+RULES = [
+    ('TIMING-18', 'Warning', 'Missing input or output delay',
+     'An input delay is missing on {:s} relative to clock(s) sys_clk_pin'),
+    ('TIMING-20', 'Warning', 'Non-clocked latch',
+     'The latch {:s} cannot be properly analyzed as its control pin is not reached by a clock'),
+    ('LUTAR-1', 'Warning', 'LUT drives async reset alert',
+     'LUT cell {:s}, with 2 or more inputs, drives asynchronous preset/clear pin(s)'),
+]
+
+
+def synthetic_report(violations):
+  '''Lines of a `report_methodology` report with `violations` spread over a few rules.'''
+  counts = [violations // len(RULES)] * len(RULES)
+  counts[0] += violations - sum(counts)
+
+  lines = [b'Report Methodology\r\n', b'\r\n', b'1. REPORT SUMMARY\r\n', b'-----------------\r\n',
+           '  Violations found: {:d}\r\n'.format(violations).encode(), b'+------+\r\n']
+  for (rule, severity, description, _), count in zip(RULES, counts):
+    lines.append('| {:s} | {:s} | {:s} | {:d} |\r\n'.format(rule, severity, description,
+                                                           count).encode())
+  lines += [b'+------+\r\n', b'\r\n', b'2. REPORT DETAILS\r\n', b'-----------------\r\n']
+
+  for (rule, severity, description, message), count in zip(RULES, counts):
+    for i in range(count):
+      lines += [
+          '{:s}#{:d} {:s}\r\n'.format(rule, i + 1, severity).encode(),
+          '{:s}  \r\n'.format(description).encode(),
+          (message.format('design/core_{:d}/stage_reg[{:d}]'.format(i // 64, i % 64)) +
+           '\r\n').encode(),
+          b'Related violations: <none>\r\n',
+          b'\r\n',
+      ]
+  lines.append(b'INFO: [Vivado 12-3199] DRC finished with 0 Errors\r\n')
+  lines.append(b'INFO: [Vivado 12-3200] report_methodology completed successfully\r\n')
+
+  return lines
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Measure report parsing and waiver throughput.')
+  parser.add_argument('--violations', type=int, default=50000,
+                      help='Number of violations in the synthetic report.')
+  args = parser.parse_args()
+
+  lines = synthetic_report(args.violations)
+  mb = sum(len(line) for line in lines) / (1024 * 1024)
+
+  start = time.perf_counter()
+  parser = report_parser.RuleReportParser()
+  for line in lines:
+    parser(line)
+  violations = parser.violations()
+  parse = time.perf_counter() - start
+
+  # Waive one rule outright, and half of another's violations by object.
+  waivers = [report_parser.Waiver('TIMING-20'),
+             report_parser.Waiver('LUTAR-1', r'core_\d*[02468]/')]
+  start = time.perf_counter()
+  remaining = report_parser.waive(violations, waivers)
+  waive = time.perf_counter() - start
+
+  print('\nParsed {:.1f} MB report with {:d} violations:'.format(mb, args.violations))
+  print('  parse:      {:8.3f} s ({:.1f} MB/s)'.format(parse, mb / parse))
+  print('  waive:      {:8.3f} s'.format(waive))
+  print('  remaining:  {:8d}'.format(sum(v.count for v in remaining)))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,299 @@
+import re
+
+
+class ParseError(Exception):
+  pass
+
+
+class Violation:
+  '''Violations of a single rule found by a report.
+
+  `details` holds the report's text for each violation listed, which names the objects involved.
+  '''
+
+  __slots__ = ('rule', 'severity', 'description', 'count', 'details')
+
+  def __init__(self, rule, severity, description, count=0, details=None):
+    self.rule = rule
+    self.severity = severity
+    self.description = description
+    self.count = count
+    self.details = details if details is not None else []
+
+  def __repr__(self):
+    return 'Violation({!r}, {!r}, count={:d})'.format(self.rule, self.severity, self.count)
+
+  def format(self):
+    header = '{:s} {:s} ({:d}): {:s}\r\n'.format(self.rule, self.severity, self.count,
+                                                 self.description)
+    return header + ''.join(self.details)
+
+
+class Waiver:
+  '''Waives violations of `rule` whose details match the regex `pattern`, or all without one.'''
+
+  def __init__(self, rule, pattern=None):
+    self.rule = rule
+    self.pattern = re.compile(pattern) if pattern else None
+
+
+def load_waivers(filename):
+  '''Read waivers, one per line as a rule ID optionally followed by a regex matching the details of
+  the violations waived.  Blank lines and # comments are ignored.
+  '''
+  waivers = []
+  with open(filename) as f:
+    for line in f:
+      fields = line.partition('#')[0].strip().split(None, 1)
+      if fields:
+        waivers.append(Waiver(*fields))
+
+  return waivers
+
+
+def waive(violations, waivers):
+  '''Return the violations that are not waived, without revisiting the report.'''
+  by_rule = {}
+  for waiver in waivers:
+    by_rule.setdefault(waiver.rule, []).append(waiver)
+
+  remaining = []
+  for violation in violations:
+    rule_waivers = by_rule.get(violation.rule)
+    if not rule_waivers:
+      remaining.append(violation)
+      continue
+
+    if any(w.pattern is None for w in rule_waivers):
+      continue
+
+    details = [d for d in violation.details if not any(w.pattern.search(d) for w in rule_waivers)]
+    count = violation.count - (len(violation.details) - len(details))
+    if count > 0:
+      remaining.append(Violation(violation.rule, violation.severity, violation.description, count,
+                                 details))
+
+  return remaining
+
+
+def _decode(lines):
+  return b''.join(lines).decode(errors='replace')
+
+
+class SectionParser:
+  '''Incremental parser of reports made of numbered sections.
+
+  Lines are fed one at a time, as they arrive, by calling the parser.  A section starts with a
+  numbered title, e.g. `1. checking no_clock (0)`, underlined with dashes and runs to the next title
+  or a line containing `END_MARKER`.  Subclasses handle each section's lines in `section_line`.
+  '''
+
+  TITLE_PATTERN = re.compile(rb'\d+\..+\r?\n')
+  RULE_PATTERN = re.compile(rb'-+\r?\n')
+  END_MARKER = None
+
+  def __init__(self):
+    self.titles = []
+    self.in_section = False
+    # Possible title, confirmed by the underline on the next line.
+    self.pending = None
+
+  def __call__(self, line):
+    # Most lines are section text, which is passed on after as few checks as possible.  Titles
+    # start with a digit.
+    if self.pending is None and not line[:1].isdigit() and not (
+        self.END_MARKER and self.END_MARKER in line):
+      if self.in_section:
+        self.section_line(line)
+      return
+
+    pending, self.pending = self.pending, None
+    if pending is not None:
+      if self.RULE_PATTERN.fullmatch(line):
+        self.titles.append(pending)
+        self.in_section = True
+        self.begin_section(pending)
+        return
+      self._text(pending)
+
+    if line[:1].isdigit() and self.TITLE_PATTERN.fullmatch(line):
+      self.pending = line
+    else:
+      self._text(line)
+
+  def _text(self, line):
+    if self.END_MARKER and self.END_MARKER in line:
+      self.end_section()
+      self.in_section = False
+    elif self.in_section:
+      self.section_line(line)
+
+  def begin_section(self, title):
+    pass
+
+  def section_line(self, line):
+    pass
+
+  def end_section(self):
+    pass
+
+
+class RuleReportParser(SectionParser):
+  '''Parser of `report_drc` and `report_methodology` output.
+
+  The summary section tabulates the violations of each rule, which the details section lists one
+  at a time, e.g. `TIMING-18#1 Warning` followed by its description.
+  '''
+
+  END_MARKER = b'completed successfully'
+  FOUND_PATTERN = re.compile(rb'\s*Violations found: (\d+)')
+  ROW_PATTERN = re.compile(rb'\|\s*(\S+)\s*\|\s*([^|]+?)\s*\|\s*([^|]*?)\s*\|\s*(\d+)\s*\|')
+  DETAIL_PATTERN = re.compile(rb'([\w.]+-\d+)#\d+ ([A-Za-z ]+?)\s*\r?\n')
+
+  def __init__(self):
+    super().__init__()
+    self.found = None
+    self.rules = {}
+    # Violation and lines of the detail being read.
+    self.violation = None
+    self.lines = None
+
+  def begin_section(self, title):
+    self.end_section()
+
+    if len(self.titles) == 1:
+      self.section_line = self._summary_line
+    elif len(self.titles) == 2:
+      self.section_line = self._detail_line
+    else:
+      self.section_line = super().section_line
+
+  def end_section(self):
+    if self.lines:
+      self.violation.details.append(_decode(self.lines))
+    self.violation = None
+    self.lines = None
+
+  def _summary_line(self, line):
+    if line.startswith(b'|'):
+      match = self.ROW_PATTERN.match(line)
+      if match:
+        rule, severity, description, count = match.group(1, 2, 3, 4)
+        self.rules[rule] = Violation(rule.decode(), severity.decode(), description.decode(),
+                                     int(count))
+    elif b'Violations found' in line:
+      match = self.FOUND_PATTERN.match(line)
+      if match:
+        self.found = int(match.group(1))
+
+  def _detail_line(self, line):
+    match = b'#' in line and self.DETAIL_PATTERN.fullmatch(line)
+    if not match:
+      if self.lines is not None:
+        self.lines.append(line)
+      return
+
+    self.end_section()
+    rule, severity = match.group(1, 2)
+    if rule not in self.rules:
+      self.rules[rule] = Violation(rule.decode(), severity.decode(), '')
+    self.violation = self.rules[rule]
+    self.lines = [line]
+
+  def violations(self):
+    if len(self.titles) != 2 or self.found is None:
+      raise ParseError('Expected summary and details sections.')
+    self.end_section()
+
+    # Violations the summary does not tabulate are counted from their details.
+    for violation in self.rules.values():
+      violation.count = max(violation.count, len(violation.details))
+
+    # The summary's total is the verdict, so violations laid out in a way the patterns miss fail
+    # rather than pass unseen.
+    parsed = sum(v.count for v in self.rules.values())
+    if parsed != self.found:
+      raise ParseError('Parsed {:d} of {:d} violations found.'.format(parsed, self.found))
+
+    return [v for v in self.rules.values() if v.count]
+
+
+class CheckTimingParser(SectionParser):
+  '''Parser of `check_timing` output, with a section per check titled with its violation count,
+  e.g. `2. checking constant_clock (3)`.
+  '''
+
+  CHECK_PATTERN = re.compile(rb'\d+\.\s*(?:checking\s+)?(.+?)\s*\((\d+)\)\r?\n')
+
+  def __init__(self):
+    super().__init__()
+    self.malformed = False
+    self.failed = []
+    self.lines = None
+
+  def begin_section(self, title):
+    self.end_section()
+
+    match = self.CHECK_PATTERN.fullmatch(title)
+    if not match:
+      self.malformed = True
+      return
+
+    name, count = match.group(1, 2)
+    if int(count):
+      violation = Violation(name.decode(), 'Warning', title.strip().decode(), int(count))
+      self.failed.append(violation)
+      self.lines = []
+
+  def section_line(self, line):
+    if self.lines is not None:
+      self.lines.append(line)
+
+  def end_section(self):
+    if self.lines is not None:
+      self.failed[-1].details.append(_decode(self.lines))
+    self.lines = None
+
+  def violations(self):
+    if not self.titles or self.malformed:
+      raise ParseError('Expected a section titled with a count per check.')
+    self.end_section()
+
+    return self.failed
+
+
+class TimingReportParser:
+  '''Parser of `report_timing -slack_less_than 0` output, with a violation detail per path.'''
+
+  RULE = 'negative_slack'
+  TITLE = b'Timing Report'
+
+  def __init__(self):
+    self.reports = 0
+    self.empty = False
+    self.paths = []
+    self.path = None
+
+  def __call__(self, line):
+    if line.rstrip() == self.TITLE:
+      self.reports += 1
+    elif not self.reports:
+      return
+    elif line.startswith(b'Slack'):
+      self.path = [line]
+      self.paths.append(self.path)
+    elif line.startswith(b'No timing paths found.'):
+      self.empty = True
+    elif self.path is not None:
+      self.path.append(line)
+
+  def violations(self):
+    if self.reports != 1 or not (self.empty or self.paths):
+      raise ParseError('Expected a single timing report.')
+
+    if not self.paths:
+      return []
+
+    details = [_decode(path) for path in self.paths]
+    return [Violation(self.RULE, 'Error', 'Timing paths with negative slack', len(details),
+                      details)]
@@ -0,0 +1,215 @@
+import os
+import os.path
+import tempfile
+import unittest
+
+import report_parser
+
+
+DRC_HEADER = b'''\
+Copyright 1986-2022 Xilinx, Inc. All Rights Reserved.
+---------------------------------------------------------------------------------------------------
+| Tool Version : Vivado v.2022.2 (lin64) Build 3671981 Fri Oct 14 04:59:54 MDT 2022
+| Command      : report_drc -no_waivers
+---------------------------------------------------------------------------------------------------
+
+Report DRC
+
+Table of Contents
+-----------------
+1. REPORT SUMMARY
+2. REPORT DETAILS
+
+1. REPORT SUMMARY
+-----------------
+            Netlist: netlist
+          Floorplan: design_1
+      Design limits: <entire design considered>
+           Ruledeck: default
+     Max violations: <unlimited>
+'''
+
+DRC_SUMMARY = b'''\
++----------+------------------+-----------------------------------------------------+------------+
+| Rule     | Severity         | Description                                         | Violations |
++----------+------------------+-----------------------------------------------------+------------+
+| CFGBVS-1 | Warning          | Missing CFGBVS and CONFIG_VOLTAGE Design Properties | 1          |
+| NSTD-1   | Critical Warning | Unspecified I/O Standard                            | 2          |
++----------+------------------+-----------------------------------------------------+------------+
+'''
+
+DRC_DETAILS = b'''\
+2. REPORT DETAILS
+-----------------
+CFGBVS-1#1 Warning
+Missing CFGBVS and CONFIG_VOLTAGE Design Properties
+Neither the CFGBVS nor CONFIG_VOLTAGE voltage property is set in the current_design.
+Related violations: <none>
+
+NSTD-1#1 Critical Warning
+Unspecified I/O Standard
+1 out of 9 logical ports use I/O standard (IOSTANDARD) value 'DEFAULT'. Problem ports: led[0].
+Related violations: <none>
+
+NSTD-1#2 Critical Warning
+Unspecified I/O Standard
+1 out of 9 logical ports use I/O standard (IOSTANDARD) value 'DEFAULT'. Problem ports: led[1].
+Related violations: <none>
+
+
+INFO: [Vivado 12-3199] DRC finished with 0 Errors, 3 Warnings
+INFO: [Vivado 12-3200] report_drc completed successfully
+'''
+
+CHECK_TIMING = b'''\
+Table of Contents
+-----------------
+1. checking no_clock (0)
+2. checking constant_clock (0)
+3. checking unconstrained_internal_endpoints (2)
+
+1. checking no_clock (0)
+------------------------
+ There are 0 register/latch pins with no clock.
+
+
+2. checking constant_clock (0)
+------------------------------
+ There are 0 register/latch pins with constant_clock.
+
+
+3. checking unconstrained_internal_endpoints (2)
+------------------------------------------------
+ There are 2 pins that are not constrained for maximum delay.
+
+ led_reg[0]/D
+ led_reg[1]/D
+
+'''
+
+TIMING_HEADER = b'''\
+Timing Report
+
+Slack (VIOLATED) :        -0.512ns  (required time - arrival time)
+  Source:                 count_reg[3]/C
+  Destination:            led_reg[0]/D
+'''
+
+
+def parse(parser, report):
+  for line in report.splitlines(keepends=True):
+    parser(line)
+  return parser.violations()
+
+
+def drc_report(found, summary=DRC_SUMMARY, details=DRC_DETAILS):
+  summary_line = '    Violations found: {:d}\n'.format(found).encode()
+  return DRC_HEADER + summary_line + summary + b'\n' + details
+
+
+class RuleReportParserTest(unittest.TestCase):
+
+  def test_summary_and_details(self):
+    violations = parse(report_parser.RuleReportParser(), drc_report(3))
+
+    self.assertEqual([(v.rule, v.severity, v.count) for v in violations],
+                     [('CFGBVS-1', 'Warning', 1), ('NSTD-1', 'Critical Warning', 2)])
+    self.assertEqual(violations[1].description, 'Unspecified I/O Standard')
+    self.assertIn('Problem ports: led[0].', violations[1].details[0])
+    self.assertIn('Problem ports: led[1].', violations[1].details[1])
+
+  def test_details_count_rules_missing_from_summary(self):
+    violations = parse(report_parser.RuleReportParser(), drc_report(3, summary=b''))
+
+    self.assertEqual([(v.rule, v.count) for v in violations], [('CFGBVS-1', 1), ('NSTD-1', 2)])
+
+  def test_no_violations(self):
+    report = drc_report(0, summary=b'', details=DRC_DETAILS[:DRC_DETAILS.index(b'CFGBVS')] +
+                        DRC_DETAILS[DRC_DETAILS.index(b'INFO'):])
+    self.assertEqual(parse(report_parser.RuleReportParser(), report), [])
+
+  def test_unparsed_violations(self):
+    # Rows and details in a layout the patterns miss, e.g. from another Vivado version.
+    summary = DRC_SUMMARY.replace(b'|', b':')
+    details = DRC_DETAILS.replace(b'#', b' ')
+    with self.assertRaises(report_parser.ParseError):
+      parse(report_parser.RuleReportParser(), drc_report(5, summary, details))
+
+  def test_missing_details(self):
+    report = drc_report(3, details=b'')
+    with self.assertRaises(report_parser.ParseError):
+      parse(report_parser.RuleReportParser(), report)
+
+
+class CheckTimingParserTest(unittest.TestCase):
+
+  def test_counts(self):
+    violations = parse(report_parser.CheckTimingParser(), CHECK_TIMING)
+
+    self.assertEqual([(v.rule, v.count) for v in violations],
+                     [('unconstrained_internal_endpoints', 2)])
+    self.assertIn('led_reg[1]/D', violations[0].details[0])
+
+  def test_passing(self):
+    report = CHECK_TIMING.replace(b'endpoints (2)', b'endpoints (0)')
+    self.assertEqual(parse(report_parser.CheckTimingParser(), report), [])
+
+  def test_malformed_title(self):
+    report = CHECK_TIMING.replace(b'endpoints (2)\n-', b'endpoints\n-')
+    with self.assertRaises(report_parser.ParseError):
+      parse(report_parser.CheckTimingParser(), report)
+
+
+class TimingReportParserTest(unittest.TestCase):
+
+  def test_failing_paths(self):
+    report = TIMING_HEADER + TIMING_HEADER[TIMING_HEADER.index(b'Slack'):]
+    violations = parse(report_parser.TimingReportParser(), report)
+
+    self.assertEqual([(v.rule, v.count) for v in violations], [('negative_slack', 2)])
+    self.assertIn('count_reg[3]/C', violations[0].details[0])
+
+  def test_no_failing_paths(self):
+    report = b'Timing Report\n\nNo timing paths found.\n'
+    self.assertEqual(parse(report_parser.TimingReportParser(), report), [])
+
+  def test_missing_report(self):
+    with self.assertRaises(report_parser.ParseError):
+      parse(report_parser.TimingReportParser(), b'ERROR: [Common 17-69] Command failed\n')
+
+
+class WaiveTest(unittest.TestCase):
+
+  def setUp(self):
+    self.violations = parse(report_parser.RuleReportParser(), drc_report(3))
+
+  def test_rule(self):
+    remaining = report_parser.waive(self.violations, [report_parser.Waiver('NSTD-1')])
+    self.assertEqual([v.rule for v in remaining], ['CFGBVS-1'])
+
+  def test_pattern_narrows_violations(self):
+    remaining = report_parser.waive(self.violations, [report_parser.Waiver('NSTD-1', r'led\[0\]')])
+
+    self.assertEqual([(v.rule, v.count) for v in remaining], [('CFGBVS-1', 1), ('NSTD-1', 1)])
+    self.assertEqual(len(remaining[1].details), 1)
+    self.assertIn('led[1]', remaining[1].details[0])
+
+  def test_pattern_matching_every_violation(self):
+    remaining = report_parser.waive(self.violations, [report_parser.Waiver('NSTD-1', r'led\[')])
+    self.assertEqual([v.rule for v in remaining], ['CFGBVS-1'])
+
+  def test_load_waivers(self):
+    with tempfile.TemporaryDirectory() as directory:
+      filename = os.path.join(directory, 'waivers.txt')
+      with open(filename, 'w') as f:
+        f.write('# Board has no configuration bank voltage pins.\n\nCFGBVS-1\nNSTD-1 led\\[0\\]\n')
+      waivers = report_parser.load_waivers(filename)
+
+    self.assertEqual([(w.rule, w.pattern and w.pattern.pattern) for w in waivers],
+                     [('CFGBVS-1', None), ('NSTD-1', r'led\[0\]')])
+    remaining = report_parser.waive(self.violations, waivers)
+    self.assertEqual([(v.rule, v.count) for v in remaining], [('NSTD-1', 1)])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,141 @@
+import contextlib
+import fcntl
+import json
+import os
+import os.path
+import shutil
+import tempfile
+
+
+class ResultCache:
+  '''Content-addressed cache of command outputs and logs, shared between processes.
+
+  Each entry is a directory named by its key holding the output files and the captured log.  Entry
+  modification times are refreshed on every hit so the least recently used entries are evicted once
+  the total size exceeds `max_size`.
+  '''
+
+  LOG = 'log'
+  OUTPUTS = 'outputs'
+  COPY_SIZE = 1024 * 1024
+
+  def __init__(self, directory, max_size):
+    self.directory = os.path.abspath(os.path.expanduser(directory))
+    self.max_size = max_size
+
+    self.entries = os.path.join(self.directory, 'entries')
+    self.stats_file = os.path.join(self.directory, 'stats.json')
+    self.lock_file = os.path.join(self.directory, 'lock')
+
+    os.makedirs(self.entries, exist_ok=True)
+
+  @contextlib.contextmanager
+  def _lock(self):
+    with open(self.lock_file, 'a') as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+  def _entry(self, key):
+    return os.path.join(self.entries, key)
+
+  def _read_stats(self):
+    try:
+      with open(self.stats_file) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return {'hits': 0, 'misses': 0}
+
+  def _record(self, field):
+    with self._lock():
+      stats = self._read_stats()
+      stats[field] += 1
+
+      with tempfile.NamedTemporaryFile('w', dir=self.directory, delete=False) as f:
+        json.dump(stats, f)
+      os.replace(f.name, self.stats_file)
+
+  def restore(self, key, outputs, log):
+    '''Copy cached outputs to their destinations and the log to a file, returning whether it hit.
+
+    `outputs` maps output names to destination paths, and `log` is a binary file.
+    '''
+    entry = self._entry(key)
+
+    try:
+      with contextlib.ExitStack() as files:
+        # Entries never change once stored, and open files stay readable should the entry be
+        # evicted, so only opening them needs the lock, not copying large checkpoints.
+        with self._lock():
+          cached = {path: files.enter_context(open(os.path.join(entry, self.OUTPUTS, name), 'rb'))
+                    for name, path in outputs.items()}
+          cached_log = files.enter_context(open(os.path.join(entry, self.LOG), 'rb'))
+
+          # Mark as recently used.
+          os.utime(entry)
+
+        for path, f in cached.items():
+          with open(path, 'wb') as out:
+            shutil.copyfileobj(f, out, self.COPY_SIZE)
+        shutil.copyfileobj(cached_log, log, self.COPY_SIZE)
+    except OSError:
+      self._record('misses')
+      return False
+
+    self._record('hits')
+    return True
+
+  def store(self, key, outputs, log):
+    '''Add outputs, mapping output names to produced paths, and their log, a binary file.'''
+    staging = tempfile.mkdtemp(dir=self.directory)
+    try:
+      os.mkdir(os.path.join(staging, self.OUTPUTS))
+      for name, path in outputs.items():
+        shutil.copyfile(path, os.path.join(staging, self.OUTPUTS, name))
+
+      with open(os.path.join(staging, self.LOG), 'wb') as f:
+        shutil.copyfileobj(log, f)
+
+      with self._lock():
+        try:
+          os.rename(staging, self._entry(key))
+        except OSError:  # Already stored by a concurrent build.
+          pass
+        self._evict()
+    finally:
+      shutil.rmtree(staging, ignore_errors=True)
+
+  def _scan(self):
+    entries = []
+    for key in os.listdir(self.entries):
+      entry = self._entry(key)
+      size = 0
+      for root, _, files in os.walk(entry):
+        size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+      entries.append((os.path.getmtime(entry), size, entry))
+
+    return entries
+
+  def _evict(self):
+    entries = sorted(self._scan())
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, entry in entries:
+      if total <= self.max_size:
+        break
+      shutil.rmtree(entry, ignore_errors=True)
+      total -= size
+
+  def stats(self):
+    with self._lock():
+      stats = self._read_stats()
+      entries = self._scan()
+
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    stats['entries'] = len(entries)
+    stats['size'] = sum(size for _, size, _ in entries)
+    stats['max_size'] = self.max_size
+    return stats
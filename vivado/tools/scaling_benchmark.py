@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import os
+import time
+
+import process_manager
+import relay_benchmark
+import vivado_client
+import vivado_server
+
+
+PART = 'xc7a35ticsg324-1l'
+
+
+def run_action(port, session):
+  '''Run synthesis through routing in a session, returning output received and client CPU time.'''
+  start_cpu = time.thread_time()
+  with vivado_client.VivadoClient('localhost', port, False) as client:
+    client.profile = []
+    client.begin_session(session, PART)
+
+    client.synth_design('top', PART)
+    client.opt_design()
+    client.place_design()
+    client.route_design()
+    client.end_session()
+
+  return sum(entry['output_bytes'] for entry in client.profile), time.thread_time() - start_cpu
+
+
+def measure(port, clients):
+  '''Run `clients` actions at once, returning the wall time, output received and client CPU.'''
+  start = time.perf_counter()
+  with concurrent.futures.ThreadPoolExecutor(clients) as executor:
+    results = list(executor.map(run_action, [port] * clients,
+                                ['client{:d}'.format(i) for i in range(clients)]))
+  wall = time.perf_counter() - start
+
+  return wall, sum(r[0] for r in results), sum(r[1] for r in results)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Measure how the server and client scale with concurrent clients.')
+  parser.add_argument('--workers', type=int, default=4, help='Number of server workers.')
+  parser.add_argument('--clients', type=int, default=8,
+                      help='Most concurrent clients, doubled from one up to this.')
+  parser.add_argument('--latency', type=float, default=0.1, help='Delay per command [s].')
+  parser.add_argument('--output_lines', type=int, default=20000,
+                      help='Number of log lines printed per command.')
+  parser.add_argument('--line_size', type=int, default=120, help='Size of each log line [B].')
+  parser.add_argument('--script', help='Fake Vivado script replaying recorded output instead.')
+  parser.add_argument('--port', type=int, default=9194, help='A port number for connection.')
+  args = parser.parse_args()
+
+  fake_args = ['--latency', str(args.latency), '--output_lines', str(args.output_lines),
+               '--line_size', str(args.line_size)]
+  if args.script:
+    fake_args = ['--script', os.path.abspath(args.script)]
+
+  monitors = [process_manager.ProcessMonitor(relay_benchmark.fake_vivado_args(*fake_args))
+              for _ in range(args.workers)]
+  pool = process_manager.ProcessPool(monitors)
+  server = process_manager.ProcessServer(pool, port=args.port, frame=vivado_server.frame_request)
+  server.run()
+  server.listening.wait()
+  # Startup prompts printed while no client is attached are dropped.
+  time.sleep(1.0)
+
+  levels = []
+  clients = 1
+  while clients <= args.clients:
+    levels.append(clients)
+    clients *= 2
+
+  try:
+    results = [(clients,) + measure(args.port, clients) for clients in levels]
+  finally:
+    server.stop()
+
+  print('\nConcurrent actions on {:d} workers:'.format(args.workers))
+  print('  {:>7s} {:>8s} {:>10s} {:>8s} {:>14s}'.format('clients', 'wall [s]', 'actions/s', 'MB/s',
+                                                         'client cpu/MB'))
+  for clients, wall, received, cpu in results:
+    mb = received / (1024 * 1024)
+    print('  {:7d} {:8.2f} {:10.2f} {:8.1f} {:12.3f} s'.format(clients, wall, clients / wall,
+                                                               mb / wall, cpu / max(mb, 1e-9)))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import argparse
+import socket
+import time
+
+import fake_vivado
+import process_manager
+import relay_benchmark
+import vivado_server
+
+
+def relay_output(s, command, end=fake_vivado.PROMPT):
+  '''Issue a command and discard output until it ends with `end`, returning bytes received.'''
+  received = 0
+  tail = b''
+  s.sendall(command)
+  while True:
+    data = s.recv(256 * 1024)
+    if not data:
+      raise RuntimeError('Connection closed before prompt.')
+    received += len(data)
+    tail = (tail + data)[-len(end):]
+    if tail == end:
+      return received
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Measure output throughput of the server.')
+  parser.add_argument('--size_mb', type=int, default=1024, help='Output per command [MB].')
+  parser.add_argument('--line_size', type=int, default=200, help='Size of each log line [B].')
+  parser.add_argument('--buffer_size', type=int, default=16 * 1024,
+                      help='Server output buffer size [KB].')
+  parser.add_argument('--read_size', type=int, default=1024, help='Server read size [KB].')
+  parser.add_argument('--framed', action='store_true',
+                      help='Relay framed requests, as clients do, rather than raw Tcl.')
+  parser.add_argument('--port', type=int, default=9193, help='A port number for connection.')
+  args = parser.parse_args()
+
+  lines = args.size_mb * 1024 * 1024 // args.line_size
+  fake_args = relay_benchmark.fake_vivado_args(
+      '--output_lines', str(lines), '--line_size', str(args.line_size))
+
+  monitor = process_manager.ProcessMonitor(fake_args, buffer_size=args.buffer_size * 1024,
+                                           read_size=args.read_size * 1024)
+  server = process_manager.ProcessServer(process_manager.ProcessPool([monitor]), port=args.port,
+                                         frame=vivado_server.frame_request)
+  server.run()
+  server.listening.wait()
+
+  try:
+    with socket.create_connection(('localhost', args.port)) as s:
+      if args.framed:
+        # Output ends with the done line, whose JSON payload ends the line.
+        s.sendall(process_manager.control_line('session', {}) + b'\r')
+        relay_output(s, b'', b'}\n')
+        sync = process_manager.control_line('run', {'id': 1, 'script': 'sync'}) + b'\r'
+        command = process_manager.control_line('run', {'id': 2, 'script': 'synth_design'}) + b'\r'
+        end = b'}\n'
+      else:
+        sync = b'sync\r'
+        command = b'synth_design\r'
+        end = fake_vivado.PROMPT
+
+      # Skip any startup prompts still in flight.
+      relay_output(s, sync, end if args.framed else b'Executed: sync\r\n' + fake_vivado.PROMPT)
+
+      start_wall = time.perf_counter()
+      start_cpu = time.process_time()
+      received = relay_output(s, command, end)
+      wall = time.perf_counter() - start_wall
+      cpu = time.process_time() - start_cpu
+  finally:
+    server.stop()
+
+  mb = received / (1024 * 1024)
+  print('\nRelayed {:.1f} MB:'.format(mb))
+  print('  wall:       {:8.2f} s'.format(wall))
+  print('  throughput: {:8.1f} MB/s'.format(mb / wall))
+  print('  server cpu: {:8.2f} s ({:.1f}% of wall)'.format(cpu, 100 * cpu / wall))
+
+
+if __name__ == '__main__':
+  main()
@@ -1,12 +1,26 @@
 #!/usr/bin/env python3
 
 import argparse
+import concurrent.futures
+import contextlib
 import functools
+import hashlib
+import json
 import os
 import os.path
+import random
 import re
 import socket
 import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import config_memory
+import process_manager
+import report_parser
+import result_cache
 
 
 def make_green(b):
@@ -27,35 +41,140 @@ class CommandTimeout(Exception):
   pass
 
 
-class VivadoClient:
-  PROMPT = b'Vivado% '
+# Captured output is held in memory up to this size, and spilled to a temporary file beyond it.
+SPILL_SIZE = 8 * 1024 * 1024
+
+
+def spill_file():
+  return tempfile.SpooledTemporaryFile(max_size=SPILL_SIZE)
+
 
-  # TODO(stridge-cruxml) Pass in the whitelist as a configuration file.
-  WHITE_LIST = [
+class VivadoClient:
+  # Default message IDs treated as informational, extended with --white_list.
+  WHITE_LIST = frozenset([
       b'Common 17-53',  # Error regarding closing non-existent project.
       b'Place 46-29',   # Warning about skipping physical synthesis in placer.
       b'Synth 8-1921',  # Incorrect warning about system task syntax.
       b'Synth 8-7080',  # Warning because design is too small to use parallel.
-  ]
+  ])
+
+  READ_SIZE = 64 * 1024
+
+  MESSAGE_PATTERN = re.compile(rb'(.+?): \[(.+?)\]')
+
+  # Resource usage Vivado reports on completing a command or phase.
+  USAGE_PATTERN = re.compile(rb'Time \(s\): cpu = (\d+):(\d+):(\d+) ; elapsed = (\d+):(\d+):(\d+) \. '
+                             rb'Memory \(MB\): peak = ([\d.]+) ; gain = (-?[\d.]+)')
+
+  LINE_TYPES = {
+      b'INFO': 'INFO',
+      b'WARNING': 'WARNING',
+      b'CRITICAL WARNING': 'CRITICAL WARNING',
+      b'ERROR': 'ERROR',
+  }
+
+  ERROR_TYPES = frozenset(['WARNING', 'CRITICAL WARNING', 'ERROR'])
+
+  COLOR_FUNCS = {
+      'COMMON': lambda x: x,
+      'INFO': make_green,
+      'WARNING': make_yellow,
+      'CRITICAL WARNING': make_red,
+      'ERROR': make_red
+  }
+
+  # Ends the output of each step of a batch with its index, Tcl return code and time taken [ms].
+  STEP_PATTERN = re.compile(rb'RULES_VIVADO_STEP (\d+) (\d+) (\d+)\r?\n')
+
+  # Counts the messages Vivado has reported of the severities in `ERROR_TYPES`, other than those
+  # white listed in `::rules_vivado_white_list`.
+  MESSAGES_PROC = (
+      'proc rules_vivado_messages {} {'
+      'set n 0; '
+      'foreach severity {WARNING {CRITICAL WARNING} ERROR} {'
+      'incr n [get_msg_config -count -severity $severity]}; '
+      'foreach id $::rules_vivado_white_list {incr n -[get_msg_config -count -id $id]}; '
+      'return $n}')
+
+  # Runs a step of a batch at global scope, unless an earlier step raised a Tcl error or reported
+  # messages failing the command, echoing its result as the interactive shell would.
+  STEP_PROC = (
+      'proc rules_vivado_step {step script} {'
+      'if {$::rules_vivado_failed} {return}; '
+      'set start [clock milliseconds]; '
+      'set rc [catch {uplevel #0 $script} result]; '
+      'if {$result ne ""} {puts $result}; '
+      'set messages [rules_vivado_messages]; '
+      'if {$rc || $messages > $::rules_vivado_messages} {set ::rules_vivado_failed 1}; '
+      'set ::rules_vivado_messages $messages; '
+      'puts "RULES_VIVADO_STEP $step $rc [expr {[clock milliseconds] - $start}]"}')
 
   def _command(timeout=None):
-    '''This setup allows default arguments.'''
+    '''This setup allows default arguments.
+
+    Output lines are passed to the `consume` keyword argument of the decorated command as they
+    arrive, rather than being accumulated.  Within `batch` the command is queued instead.
+    '''
     def _decorate(function):
+      stage = function.__name__.lstrip('_')
+
       @functools.wraps(function)
-      def wrapped_function(self, *args, **kwargs):
+      def wrapped_function(self, *args, consume=None, **kwargs):
+        if self.steps is not None:
+          self.steps.append({'stage': stage, 'timeout': timeout, 'consume': consume})
+          function(self, *args, **kwargs)
+          return
+
+        self.stage = stage
         function(self, *args, **kwargs)
-        return self._get_response(timeout=timeout)
+
+        if self.profile is None:
+          self._get_response(timeout, consume)
+        else:
+          self._get_profiled_response(stage, timeout, consume)
 
       return wrapped_function
     return _decorate
 
-  def __init__(self, host, port, verbose):
+  def __init__(self, host, port, verbose, white_list=(), message_log=None, waivers=()):
     self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     self.socket.settimeout(0.2)
     self.socket.connect((host, port))
+    self.address = (host, port)
+    # ID of the last request, which the server echoes when it completes.
+    self.request_id = 0
 
-    self.buffer = bytearray()
+    self._reset_buffer()
+    self.configure(verbose, white_list, message_log, waivers)
+
+  def configure(self, verbose, white_list=(), message_log=None, waivers=()):
+    '''Reset per command settings, allowing the connection to be reused for another command.'''
     self.verbose = verbose
+    self.white_list = self.WHITE_LIST.union(white_list)
+    # Check violations that are not reported as errors.
+    self.waivers = waivers
+
+    # Machine readable messages are written as JSON lines to this file when set.
+    self.message_log = message_log
+    self.stage = None
+
+    # Per command timing and resource usage is appended here when set to a list.
+    self.profile = None
+    self.output_bytes = 0
+    self.usage = None
+
+    # Server's knowledge of the worker serving the current session, and whether the worker already
+    # holds the design of the session's checkpoint open.
+    self.state = {}
+    self.design_open = False
+
+    # Commands queued by `batch` when set to a list.
+    self.steps = None
+
+    # Captures displayed output when set to a bytearray.
+    self.log = None
+    # Holds output back, rather than displaying it, when set to a bytearray.
+    self.deferred = None
 
   def __enter__(self):
     return self
@@ -66,57 +185,156 @@ class VivadoClient:
   def close(self):
     self.socket.close()
 
+  def begin_session(self, session, part, checkpoint=None):
+    '''Announce a session to the server and wait for a worker, returning the worker's state.
+
+    Sessions opening a checkpoint pass its hash, preferring a worker that holds its design open.
+    '''
+    header = {'session': session, 'part': part, 'checkpoint': checkpoint}
+    self.socket.sendall(process_manager.control_line('session', header) + b'\r')
+
+    # Waiting for an idle worker may take a while.
+    self.socket.settimeout(None)
+    line = self._get_line()
+    if not line.startswith(process_manager.CONTROL_PREFIX):
+      raise RuntimeError('Unexpected response to session: {!r}'.format(line))
+
+    _, self.state = process_manager.parse_control_line(line)
+    self.design_open = checkpoint is not None and self.state.get('checkpoint') == checkpoint
+    return self.state
+
+  def entered_directory(self, path):
+    '''Tell the server the worker changed to a directory, so later sessions there need not.'''
+    self.socket.sendall(process_manager.control_line('cwd', {'cwd': path}) + b'\r')
+
+  def hold_design(self, checkpoint):
+    '''Tell the server the worker holds the design of a checkpoint, by hash, open as it is on disk.
+
+    Any further Tcl in the session may change the design, so the server then forgets it.
+    '''
+    self.socket.sendall(process_manager.control_line('design', {'checkpoint': checkpoint}) + b'\r')
+
+  def end_session(self):
+    '''Release the worker while keeping the connection open for another session.'''
+    self.socket.sendall(process_manager.control_line('end') + b'\r')
+    self.state = {}
+    self.design_open = False
+
+  def _write(self, data):
+    if self.deferred is not None:
+      self.deferred.write(data)
+      return
+
+    os.write(sys.stdout.fileno(), data)
+    if self.log is not None:
+      self.log.write(data)
+
   def _reset_buffer(self):
     self.buffer = bytearray()
+    # Length of the buffer already searched for a newline.
+    self.searched = 0
 
   def _get_line(self):
     while True:
-      if self.buffer == self.PROMPT:
-        self._reset_buffer()
-        return bytes(self.PROMPT)
-
-      line, sep, remaining = self.buffer.partition(b'\n')
+      # Only newly received data is searched, so long bursts without newlines are scanned once.
+      end = self.buffer.find(b'\n', self.searched)
 
-      if sep:
-        self.buffer = remaining
-        return bytes(line + sep)
+      if end >= 0:
+        line = bytes(self.buffer[:end + 1])
+        # Deleting from the front of a bytearray does not copy the remainder.
+        del self.buffer[:end + 1]
+        self.searched = 0
+        return line
 
+      self.searched = len(self.buffer)
       try:
-        self.buffer += self.socket.recv(1024)
+        data = self.socket.recv(self.READ_SIZE)
       except socket.timeout:
         return b''
 
+      if not data:
+        raise ConnectionError('Server closed the connection.')
+      self.buffer += data
+
+  def _log_message(self, severity, message_id, text):
+    record = {
+        'severity': severity.decode(errors='replace'),
+        'id': message_id.decode(errors='replace'),
+        'text': text.strip().decode(errors='replace'),
+        'stage': self.stage,
+        'timestamp': time.time(),
+    }
+    self.message_log.write(json.dumps(record) + '\n')
+
   def _handle_line(self, line):
     line_type = 'COMMON'
 
-    match = re.match(b'(.+?): \[(.+?)\]', line)
+    # Most output is not a message, so skip the regex unless it could match.
+    match = b': [' in line and self.MESSAGE_PATTERN.match(line)
     if match:
-      if match.group(2) in self.WHITE_LIST:
+      severity, message_id = match.group(1, 2)
+
+      if message_id in self.white_list:
         line_type = 'INFO'
-      elif match.group(1) in (b'INFO', b'WARNING', b'CRITICAL WARNING', b'ERROR'):
-        line_type = match.group(1).decode()
       else:
-        line_type = 'INFO'
+        line_type = self.LINE_TYPES.get(severity, 'INFO')
 
-    is_error = line_type in ('WARNING', 'CRITICAL WARNING', 'ERROR')
+      if self.message_log:
+        self._log_message(severity, message_id, line[match.end():])
 
-    color_func = {
-        'COMMON': lambda x: x,
-        'INFO': make_green,
-        'WARNING': make_yellow,
-        'CRITICAL WARNING': make_red,
-        'ERROR': make_red
-    }
+    is_error = line_type in self.ERROR_TYPES
 
     if self.verbose or is_error:
-      os.write(sys.stdout.fileno(), color_func[line_type](line))
+      self._write(self.COLOR_FUNCS[line_type](line))
 
     return not is_error
 
-  def _get_response(self, timeout=None):
+  def _profile_line(self, line):
+    self.output_bytes += len(line)
+
+    match = b'Time (s):' in line and self.USAGE_PATTERN.search(line)
+    if match:
+      t = [int(x) for x in match.group(1, 2, 3, 4, 5, 6)]
+      self.usage = {
+          'cpu': t[0] * 3600 + t[1] * 60 + t[2],
+          'elapsed': t[3] * 3600 + t[4] * 60 + t[5],
+          'peak_memory_mb': float(match.group(7)),
+          'gain_memory_mb': float(match.group(8)),
+      }
+
+  def _get_profiled_response(self, stage, timeout, consume):
+    self.output_bytes = 0
+    self.usage = None
+
+    entry = {'command': stage, 'success': False}
+    start = time.perf_counter()
+    try:
+      self._get_response(timeout, consume)
+      entry['success'] = True
+    finally:
+      entry['wall'] = time.perf_counter() - start
+      entry['output_bytes'] = self.output_bytes
+      # Vivado's figures from the last completion line, if it reported any.
+      if self.usage:
+        entry.update(self.usage)
+      self.profile.append(entry)
+
+  def _request(self, script):
+    '''Send a Tcl script, whose output the server ends with a `done` control line.'''
+    self.request_id += 1
+    payload = {'id': self.request_id, 'script': script.decode()}
+    self.socket.sendall(process_manager.control_line('run', payload) + b'\r')
+
+  def _return_code(self, line):
+    command, payload = process_manager.parse_control_line(line)
+    if command != 'done' or payload['id'] != self.request_id:
+      raise RuntimeError('Unexpected control line: {!r}'.format(line))
+    return payload['rc']
+
+  def _get_response(self, timeout=None, consume=None):
+    '''Handle output until the request completes, passing each line to `consume` as it arrives.'''
     self.socket.settimeout(timeout)
 
-    resp = bytearray()
     success = True
     while True:
       line = self._get_line()
@@ -125,310 +343,589 @@ class VivadoClient:
       if not line:
         raise CommandTimeout()
 
-      if not self._handle_line(line):
-        success = False
-
       # Command has completed.
-      if line == self.PROMPT:
+      if line.startswith(process_manager.CONTROL_PREFIX):
+        if self._return_code(line):
+          self._write(make_red('\n{:s} raised a Tcl error.\n'.format(self.stage).encode()))
+          success = False
         if not success:
           raise CommandFailure()
-        return resp.decode()
+        return
+
+      if self.profile is not None:
+        self._profile_line(line)
+
+      if not self._handle_line(line):
+        success = False
+
+      if consume:
+        consume(line)
+
+  def _send(self, data):
+    if self.steps is not None:
+      # Queued commands are run by the step procedure, without their line ending.
+      self.steps[-1]['command'] = data.rstrip(b'\r')
+    else:
+      self._request(data.rstrip(b'\r'))
+
+  @contextlib.contextmanager
+  def batch(self):
+    '''Queue the commands issued within the block and send them as a single Tcl line on leaving it.
+
+    One round trip then replaces one per command, while output, profiles and failures are still
+    attributed to the step that produced them.  Steps after a Tcl error, or after messages that fail
+    the command, are skipped.  Commands whose results are read, such as `get_hw_targets`, cannot be
+    batched.
+    '''
+    self.steps = []
+    try:
+      yield
+      steps = self.steps
+    finally:
+      self.steps = None
+
+    if steps:
+      self._run_batch(steps)
+
+  def _begin_step(self, step):
+    self.stage = step['stage']
+    self.output_bytes = 0
+    self.usage = None
+
+  def _end_step(self, step, success, wall):
+    if self.profile is None:
+      return
+
+    entry = {'command': step['stage'], 'success': success, 'wall': wall,
+             'output_bytes': self.output_bytes}
+    if self.usage:
+      entry.update(self.usage)
+    self.profile.append(entry)
+
+  def _run_batch(self, steps):
+    white_list = b' '.join(b'{%s}' % message_id for message_id in sorted(self.white_list))
+    script = [self.MESSAGES_PROC.encode(), self.STEP_PROC.encode(), b'set ::rules_vivado_failed 0',
+              b'set ::rules_vivado_white_list {%s}' % white_list,
+              b'set ::rules_vivado_messages [rules_vivado_messages]']
+    script += [b'rules_vivado_step %d {%s}' % (i, step['command']) for i, step in enumerate(steps)]
+    self._request(b'; '.join(script))
+
+    timeouts = [step['timeout'] for step in steps]
+    self.socket.settimeout(None if None in timeouts else max(timeouts))
+
+    failed = set()
+    index = 0
+    self._begin_step(steps[0])
+    while True:
+      line = self._get_line()
+
+      # Timeout.
+      if not line:
+        raise CommandTimeout()
+
+      # Batch has completed.
+      if line.startswith(process_manager.CONTROL_PREFIX):
+        if self._return_code(line):
+          failed.add(min(index, len(steps) - 1))
+        break
+
+      match = line.startswith(b'RULES_VIVADO_STEP') and self.STEP_PATTERN.fullmatch(line)
+      if match:
+        index, rc, wall = (int(x) for x in match.group(1, 2, 3))
+        if rc:
+          failed.add(index)
+        self._end_step(steps[index], index not in failed, wall / 1000)
+
+        index += 1
+        if index < len(steps):
+          self._begin_step(steps[index])
+        continue
+
+      if self.profile is not None:
+        self._profile_line(line)
+
+      if not self._handle_line(line):
+        failed.add(min(index, len(steps) - 1))
+
+      consume = steps[index]['consume'] if index < len(steps) else None
+      if consume:
+        consume(line)
 
-      resp += line
+    if failed:
+      index = min(failed)
+      self._write(make_red('\nStep {:d} of {:d} ({:s}) failed.\n'.format(
+          index + 1, len(steps), steps[index]['stage']).encode()))
+      raise CommandFailure()
 
   @_command()
   def change_directory(self, path):
-    self.socket.sendall('cd {:s}\r'.format(path).encode())
+    self._send('cd {:s}\r'.format(path).encode())
 
   @_command()
   def set_part(self, part):
-    self.socket.sendall('set_part {:s}\r'.format(part).encode())
+    self._send('set_part {:s}\r'.format(part).encode())
 
   @_command()
   def read_xdc(self, constraints):
     cmd = 'read_xdc {{{:s}}}\r'.format(' '.join(constraints))
-    self.socket.sendall(cmd.encode())
+    self._send(cmd.encode())
 
   @_command()
   def read_verilog(self, files, system_verilog=False):
     sv_flag = ' -sv' if system_verilog else ''
     cmd = 'read_verilog{:s} {{{:s}}}\r'.format(sv_flag, ' '.join(files))
-    self.socket.sendall(cmd.encode())
+    self._send(cmd.encode())
+
+  @_command()
+  def synth_design(self, top, part, out_of_context=False):
+    mode_flag = ' -mode out_of_context' if out_of_context else ''
+    cmd = 'synth_design -top {:s} -part {:s}{:s}\r'.format(top, part, mode_flag)
+    self._send(cmd.encode())
 
   @_command()
-  def synth_design(self, top, part):
-    self.socket.sendall('synth_design -top {:s} -part {:s}\r'.format(top, part).encode())
+  def write_verilog_stub(self, filename):
+    self._send('write_verilog -force -mode synth_stub {:s}\r'.format(filename).encode())
 
   @_command()
   def close_project(self):
-    self.socket.sendall(b'close_project\r')
+    # Closing with no project open raises a Tcl error, which would end a batch early.
+    self._send(b'catch {close_project}\r')
 
   @_command()
   def write_checkpoint(self, filename):
-    self.socket.sendall('write_checkpoint -force {:s}\r'.format(filename).encode())
+    self._send('write_checkpoint -force {:s}\r'.format(filename).encode())
 
   @_command()
-  def read_checkpoint(self, filename):
-    self.socket.sendall('read_checkpoint {:s}\r'.format(filename).encode())
+  def read_checkpoint(self, filename, incremental=False):
+    incremental_flag = ' -incremental' if incremental else ''
+    cmd = 'read_checkpoint{:s} {:s}\r'.format(incremental_flag, filename)
+    self._send(cmd.encode())
 
   @_command()
-  def link_design(self):
-    self.socket.sendall(b'link_design\r')
+  def link_design(self, top=None, part=None):
+    cmd = 'link_design'
+    if top:
+      cmd += ' -top {:s} -part {:s}'.format(top, part)
+    self._send((cmd + '\r').encode())
 
   @_command()
   def opt_design(self):
-    self.socket.sendall(b'opt_design\r')
+    self._send(b'opt_design\r')
 
   @_command()
   def place_design(self):
-    self.socket.sendall(b'place_design -no_timing_driven\r')
+    self._send(b'place_design -no_timing_driven\r')
 
   @_command()
   def phys_opt_design(self):
-    self.socket.sendall(b'phys_opt_design\r')
+    self._send(b'phys_opt_design\r')
 
   @_command()
   def route_design(self):
-    self.socket.sendall(b'route_design\r')
+    self._send(b'route_design\r')
 
   @_command()
   def write_bitstream(self, filename):
-    self.socket.sendall('write_bitstream -force {:s}\r'.format(filename).encode())
+    self._send('write_bitstream -force {:s}\r'.format(filename).encode())
 
   @_command()
   def open_hw_manager(self):
-    self.socket.sendall(b'open_hw_manager\r')
+    self._send(b'open_hw_manager\r')
 
   @_command()
   def close_hw_manager(self):
-    self.socket.sendall(b'close_hw_manager\r')
+    self._send(b'close_hw_manager\r')
 
   @_command()
-  def connect_hw_server(self):
-    self.socket.sendall(b'connect_hw_server\r')
+  def connect_hw_server(self, url=None):
+    url_flag = ' -url {:s}'.format(url) if url else ''
+    self._send('connect_hw_server{:s}\r'.format(url_flag).encode())
+
+  @_command()
+  def _get_hw_targets(self):
+    self._send(b'get_hw_targets\r')
+
+  def get_hw_targets(self):
+    lines = []
+    self._get_hw_targets(consume=lines.append)
+
+    # The result is echoed as a Tcl list following any messages.
+    return lines[-1].decode().split() if lines else []
 
   @_command()
-  def open_hw_target(self):
-    self.socket.sendall(b'open_hw_target\r')
+  def open_hw_target(self, target=None):
+    target_arg = ' {:s}'.format(target) if target else ''
+    self._send('open_hw_target{:s}\r'.format(target_arg).encode())
 
   @_command()
   def set_property(self, prop_dict, objects):
     dict_string = ' '.join(['{} {}'.format(key, val) for key, val in prop_dict.items()])
     cmd = 'set_property -dict {{{:s}}} [{:s}]\r'.format(dict_string, objects)
-    self.socket.sendall(cmd.encode())
+    self._send(cmd.encode())
 
   @_command()
   def program_hw_devices(self):
-    self.socket.sendall(b'program_hw_devices [current_hw_device]\r')
+    self._send(b'program_hw_devices [current_hw_device]\r')
 
   @_command()
   def write_cfgmem(self, input_file, output_file, size, interface):
     cmd_args = [
         'write_cfgmem',
-        '-format bin',
+        '-format {:s}'.format('mcs' if output_file.endswith('.mcs') else 'bin'),
         '-size {:d}'.format(size),
         '-interface {:s}'.format(interface),
         '-loadbit {{up 0x00000000 {:s}}}'.format(input_file),
         '-force',
         '-file {:s}\r'.format(output_file),
     ]
-    self.socket.sendall(' '.join(cmd_args).encode())
+    self._send(' '.join(cmd_args).encode())
 
   @_command()
   def create_hw_cfgmem(self, memory):
     cmd = 'create_hw_cfgmem -hw_device [current_hw_device] {:s}\r'.format(memory)
-    self.socket.sendall(cmd.encode())
+    self._send(cmd.encode())
 
   @_command()
   def program_hw_cfgmem(self):
-    self.socket.sendall(b'program_hw_cfgmem [current_hw_cfgmem]\r')
+    self._send(b'program_hw_cfgmem [current_hw_cfgmem]\r')
 
   @_command()
   def create_hw_bitstream(self, filename):
     cmd = 'create_hw_bitstream -hw_device [current_hw_device] {:s}\r'.format(filename)
-    self.socket.sendall(cmd.encode())
+    self._send(cmd.encode())
 
   @_command()
   def boot_hw_device(self):
-    self.socket.sendall(b'boot_hw_device [current_hw_device]\r')
+    self._send(b'boot_hw_device [current_hw_device]\r')
 
   @_command()
-  def _check_timing(self):
-    self.socket.sendall(b'check_timing\r')
-
-  def check_timing(self):
-    resp = self._check_timing()
-
-    header = r'^\d+\..+\r\n-+\r\n'
-    pattern = r'{}[\s\S]+?(?=(?:{})|\Z)'.format(header, header)
-
-    checks = re.findall(pattern, resp, flags=re.MULTILINE)
-
-    if not checks:
-      raise RuntimeError('Could not parse check_timing response.')
-
-    errors = []
-    for check in checks:
-      match = re.match(r'\d+\..+\((\d+)\)\r\n', check)
-
-      if not match:
-        raise RuntimeError('Could not parse check_timing response.')
+  def refresh_hw_device(self):
+    self._send(b'refresh_hw_device [current_hw_device]\r')
 
-      if int(match.group(1)) != 0:
-        errors.append(check)
+  @_command()
+  def _get_done(self):
+    self._send(b'get_property REGISTER.IR.BIT5_DONE [current_hw_device]\r')
 
-    if errors:
-      os.write(sys.stdout.fileno(), make_red(b'\nCheck timing produced errors:\n\n'))
+  def is_done(self):
+    '''Whether the device reports it is configured.'''
+    # Registers are cached, e.g. from the helper bitstream loaded to program flash, until refreshed.
+    self.refresh_hw_device()
+    lines = []
+    self._get_done(consume=lines.append)
+    return bool(lines) and lines[-1].strip() == b'1'
 
-      for error in errors:
-        os.write(sys.stdout.fileno(), make_red(error.encode()))
+  @_command()
+  def _check_timing(self):
+    self._send(b'check_timing\r')
 
-    return len(errors) == 0
+  def check_timing(self):
+    return self._check_report(self._check_timing, report_parser.CheckTimingParser(),
+                              'Check timing')
 
   @_command()
   def _report_drc(self):
-    self.socket.sendall(b'report_drc -no_waivers -upgrade_cw '
+    self._send(b'report_drc -no_waivers -upgrade_cw '
         b'-ruledecks {default opt_checks placer_checks router_checks '
         b'bitstream_checks incr_eco_checks eco_checks abs_checks}\r')
 
-  def _handle_report(self, response, name):
-    header = r'^\d+\..+\r\n-+\r\n'
-    pattern = r'{}[\s\S]+?(?=(?:{})|^.+completed successfully)'.format(header, header)
+  def _check_report(self, command, parser, name):
+    '''Run a report, parsing it as it arrives, and display violations that are not waived.'''
+    command(consume=parser)
 
-    sections = re.findall(pattern, response, flags=re.MULTILINE)
-    if len(sections) != 2:
-      raise RuntimeError('Could not parse Report {:s} response.'.format(name))
-
-    match = re.search(r'Violations found: (\d+)\s*$', response, flags=re.MULTILINE)
-    if not match:
-      raise RuntimeError('Could not parse Report {:s} response.'.format(name))
-    errors = int(match.group(1))
+    try:
+      violations = report_parser.waive(parser.violations(), self.waivers)
+    except report_parser.ParseError:
+      raise RuntimeError('Could not parse {:s} response.'.format(name))
 
-    if errors:
-      os.write(sys.stdout.fileno(),
-          make_red('\nReport {:s} produced {:d} errors:\n\n'.format(name, errors).encode()))
-      os.write(sys.stdout.fileno(), make_red(sections[1].encode()))
-      os.write(sys.stdout.fileno(), make_red(sections[0].encode()))
+    if violations:
+      errors = sum(v.count for v in violations)
+      self._write(make_red('\n{:s} produced {:d} errors:\n\n'.format(name, errors).encode()))
+      for violation in violations:
+        self._write(make_red(violation.format().encode()))
 
-    return errors == 0
+    return not violations
 
   def report_drc(self):
-    resp = self._report_drc()
-    return self._handle_report(resp, 'DRC')
+    return self._check_report(self._report_drc, report_parser.RuleReportParser(), 'Report DRC')
 
   @_command()
   def _report_methodology(self):
-    self.socket.sendall(b'report_methodology -no_waivers -checks [get_methodology_checks]\r')
+    self._send(b'report_methodology -no_waivers -checks [get_methodology_checks]\r')
 
   def report_methodology(self):
-    resp = self._report_methodology()
-    return self._handle_report(resp, 'Methodology')
+    return self._check_report(self._report_methodology, report_parser.RuleReportParser(),
+                              'Report Methodology')
 
   @_command()
   def _report_timing(self):
-    self.socket.sendall(b'report_timing -delay_type min_max -max_paths 1 -slack_less_than 0\r')
+    self._send(b'report_timing -delay_type min_max -max_paths 1 -slack_less_than 0\r')
 
   def report_timing(self):
-    resp = self._report_timing()
+    return self._check_report(self._report_timing, report_parser.TimingReportParser(),
+                              'Report timing')
+
+
+def checkpoint_hash(path):
+  '''Hash of a checkpoint's contents, identifying the design in it wherever it is stored.'''
+  h = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+      h.update(chunk)
+  return h.hexdigest()
 
-    sections = re.split(r'^Timing Report\r\n', resp, flags=re.MULTILINE)
 
-    if len(sections) != 2:
-      raise RuntimeError('Could not parse Report {:s} response.'.format(name))
+def _input_design(args):
+  '''Hash of the input checkpoint when it is the whole design, with no constraints read into it.'''
+  path = getattr(args, 'input', None)
+  if not path or not path.endswith('.dcp') or getattr(args, 'constraint', None):
+    return None
+  try:
+    return checkpoint_hash(path)
+  except OSError:
+    return None
+
+
+def open_session(client, args):
+  client.begin_session(args.session, args.part, _input_design(args))
+  if client.state.get('cwd') != os.getcwd():
+    client.change_directory(os.getcwd())
+    # Only once it succeeded, or the worker would be taken to be in a directory it never entered.
+    client.entered_directory(os.getcwd())
+
+
+def _hold_output(client, path):
+  '''Tell the server the worker holds the design of the checkpoint it just wrote.'''
+  try:
+    client.hold_design(checkpoint_hash(path))
+  except OSError:  # Written where the client cannot read it.
+    pass
+
+
+def _open_checkpoint(client, args):
+  '''Read and link the input checkpoint, unless the worker already holds its design open.'''
+  if client.design_open:
+    return
+
+  preamble(client, args)
+  client.read_checkpoint(args.input)
+  client.link_design()
 
-    match = re.search(r'No timing paths found.', sections[1])
-    if not match:
-      os.write(sys.stdout.fileno(), make_red(b'\nReport timing produced errors:\n\n'))
-      os.write(sys.stdout.fileno(), make_red(sections[1].encode()))
-      return False
 
-    return True
+def _reset_project(client, args):
+  # The server may have already left the worker with an empty project on this part.
+  clean = client.state.get('clean', False)
+  if not clean:
+    client.close_project()
+  if not clean or client.state.get('part') != args.part:
+    client.set_part(args.part)
 
 
 def preamble(client, args):
-  client.close_project()
-  client.set_part(args.part)
+  _reset_project(client, args)
 
   if args.constraint:
     client.read_xdc(args.constraint)
 
 
-def synthesize(client, args):
-  preamble(client, args)
-
+def _synthesize(client, args, out_of_context=False):
   # Check extensions for system verilog.
   sv = False
   if any([f.endswith('.sv') for f in args.verilog]):
     sv = True
 
   client.read_verilog(args.verilog, sv)
-  client.synth_design(args.top, args.part)
+  client.synth_design(args.top, args.part, out_of_context)
 
-  client.write_checkpoint(args.output)
 
+def _place(client, incremental=None):
+  # Reuse placement and routing from a reference checkpoint where the design is unchanged.
+  if incremental:
+    client.read_checkpoint(incremental, incremental=True)
 
-def place(client, args):
-  preamble(client, args)
-
-  client.read_checkpoint(args.input)
-  client.link_design()
   client.opt_design()
   client.place_design()
   client.phys_opt_design()
 
+
+def _route(client):
+  client.route_design()
+
+
+def _link_ooc(client, args):
+  '''Fill the black boxes left by stubs with the out-of-context checkpoints of their modules.'''
   client.write_checkpoint(args.output)
+  client.close_project()
 
+  client.read_checkpoint(args.output)
+  for checkpoint in args.ooc_checkpoint:
+    client.read_checkpoint(checkpoint)
+  client.link_design(args.top, args.part)
 
-def route(client, args):
-  preamble(client, args)
 
-  client.read_checkpoint(args.input)
-  client.link_design()
-  client.route_design()
+def synthesize(client, args):
+  with client.batch():
+    preamble(client, args)
+    _synthesize(client, args, args.ooc)
 
-  client.write_checkpoint(args.output)
+    if args.ooc_checkpoint:
+      _link_ooc(client, args)
+    if args.stub:
+      client.write_verilog_stub(args.stub)
 
+    client.write_checkpoint(args.output)
 
-def bitstream(client, args):
-  preamble(client, args)
 
-  client.read_checkpoint(args.input)
-  client.link_design()
+def place(client, args):
+  with client.batch():
+    _open_checkpoint(client, args)
+    _place(client, args.incremental)
+
+    client.write_checkpoint(args.output)
+
+  # Route reads no constraints on top of the placed checkpoint, so it may skip reading it back.
+  _hold_output(client, args.output)
+
+
+def route(client, args):
+  with client.batch():
+    _open_checkpoint(client, args)
+    _route(client)
+
+    client.write_checkpoint(args.output)
+
 
-  client.write_bitstream(args.output)
+def bitstream(client, args):
+  # Parallel checks run on other workers while this one writes the bitstream.
+  checks = None
+  if args.check and _parallel_checks(client, args):
+    checks = _start_parallel_checks(client, args)
+
+  try:
+    with client.batch():
+      _open_checkpoint(client, args)
+      client.write_bitstream(args.output)
+  except BaseException:
+    if checks:
+      _abandon_parallel_checks(checks)
+    raise
+
+  if checks:
+    # Free this connection's worker for the checks still waiting for one.
+    client.end_session()
+    if not all(_finish_parallel_checks(client, checks).values()):
+      raise CommandFailure()
+    return
 
   if args.check:
-    if not _check(client):
+    if not all(_check(client).values()):
       raise CommandFailure()
 
 
-def load(client, args):
-  preamble(client, args)
+def implement(client, args):
+  with client.batch():
+    _reset_project(client, args)
 
-  client.open_hw_manager()
-  client.connect_hw_server()
-  client.open_hw_target()
+    _synthesize(client, args)
+    if args.synth_checkpoint:
+      client.write_checkpoint(args.synth_checkpoint)
+
+    # Constraints are applied after synthesis, matching the separate synth and place steps.
+    if args.constraint:
+      client.read_xdc(args.constraint)
+    _place(client, args.incremental)
+    if args.place_checkpoint:
+      client.write_checkpoint(args.place_checkpoint)
+
+    _route(client)
+    if args.route_checkpoint:
+      client.write_checkpoint(args.route_checkpoint)
+
+    if args.bitstream_constraint:
+      client.read_xdc(args.bitstream_constraint)
+    client.write_bitstream(args.output)
+
+  if args.check:
+    if not all(_check(client).values()):
+      raise CommandFailure()
+
+
+def _load_device(client, args):
   client.set_property({'PROGRAM.FILE': args.input}, 'current_hw_device')
   client.program_hw_devices()
-  client.close_hw_manager()
+
+
+def load(client, args):
+  if args.all_targets:
+    program_all_targets(client, args, _load_device)
+    return
+
+  with client.batch():
+    preamble(client, args)
+
+    client.open_hw_manager()
+    client.connect_hw_server(args.hw_server)
+    client.open_hw_target()
+    _load_device(client, args)
+    client.close_hw_manager()
+
+
+def write_cfg_mem(args):
+  '''Write configuration memory without Vivado, returning whether the interface is supported.'''
+  if args.vivado or args.interface not in config_memory.INTERFACES:
+    return False
+
+  config_memory.write_config_memory(args.input, args.output, args.size, args.interface)
+  return True
+
+
+def _first_difference(a, b):
+  '''Offset of the first byte that differs between two files, or None if they are identical.'''
+  with open(a, 'rb') as fa, open(b, 'rb') as fb:
+    offset = 0
+    while True:
+      chunk_a = fa.read(1024 * 1024)
+      chunk_b = fb.read(1024 * 1024)
+      if chunk_a != chunk_b:
+        n = min(len(chunk_a), len(chunk_b))
+        return offset + next((i for i in range(n) if chunk_a[i] != chunk_b[i]), n)
+      if not chunk_a:
+        return None
+      offset += len(chunk_a)
 
 
 def cfg_mem(client, args):
-  preamble(client, args)
-  client.write_cfgmem(
-      input_file=args.input,
-      output_file=args.output,
-      size=args.size,
-      interface=args.interface
-  )
+  output = args.output
+  if args.verify:
+    if not write_cfg_mem(args):
+      client._write(make_red(b'\nNo Python backend for the interface to verify.\n'))
+      raise CommandFailure()
+    root, ext = os.path.splitext(args.output)
+    output = '{:s}_vivado{:s}'.format(root, ext)
+
+  with client.batch():
+    preamble(client, args)
+    client.write_cfgmem(
+        input_file=args.input,
+        output_file=output,
+        size=args.size,
+        interface=args.interface
+    )
+
+  if args.verify:
+    difference = _first_difference(args.output, output)
+    for path in (output, os.path.splitext(output)[0] + '.prm'):
+      try:
+        os.remove(path)
+      except OSError:
+        pass
 
+    if difference is not None:
+      client._write(make_red('\nConfiguration memory differs from Vivado at byte {:d}.\n'.format(
+          difference).encode()))
+      raise CommandFailure()
 
-def flash(client, args):
-  preamble(client, args)
 
-  client.open_hw_manager()
-  client.connect_hw_server()
-  client.open_hw_target()
+def _flash_device(client, args):
   client.create_hw_cfgmem(args.memory)
 
   props = {
@@ -449,31 +946,314 @@ def flash(client, args):
   client.program_hw_cfgmem()
   client.boot_hw_device()
 
+
+def flash(client, args):
+  if args.all_targets:
+    program_all_targets(client, args, _flash_device)
+    return
+
+  with client.batch():
+    preamble(client, args)
+
+    client.open_hw_manager()
+    client.connect_hw_server(args.hw_server)
+    client.open_hw_target()
+    _flash_device(client, args)
+    client.close_hw_manager()
+
+
+class _Connections:
+  '''Connections of threads working on workers of their own, which may be abandoned.  Closing them
+  wakes the threads, and makes the server interrupt their workers.
+  '''
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.clients = set()
+    self.abandoned = False
+
+  def add(self, client):
+    '''Track a connection, returning False if the work was abandoned before it connected.'''
+    with self.lock:
+      if not self.abandoned:
+        self.clients.add(client)
+      return not self.abandoned
+
+  def remove(self, client):
+    with self.lock:
+      self.clients.discard(client)
+
+  def abandon(self):
+    with self.lock:
+      self.abandoned = True
+      for client in self.clients:
+        try:
+          client.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:  # Already closed.
+          pass
+
+
+def _on_worker(client, args, work, connections=None):
+  '''Run `work(worker)` in a session on a separate connection, and so worker, for running work in
+  parallel.  Returns its result, or False if a command failed, with the worker's deferred output and
+  profile for `_replay`.
+  '''
+  with VivadoClient(*client.address, client.verbose, client.white_list,
+                    client.message_log, client.waivers) as worker:
+    # Output is displayed in order once all the parallel work completes.
+    worker.deferred = spill_file()
+    if client.profile is not None:
+      worker.profile = []
+
+    if connections and not connections.add(worker):
+      return False, worker.deferred, worker.profile
+    try:
+      open_session(worker, args)
+      result = work(worker)
+    except (CommandTimeout, CommandFailure):
+      result = False
+    finally:
+      if connections:
+        connections.remove(worker)
+
+    return result, worker.deferred, worker.profile
+
+
+def _replay(client, output, profile):
+  '''Display the deferred output of work done on another worker, and add its profile.'''
+  with output:
+    output.seek(0)
+    for chunk in iter(lambda: output.read(VivadoClient.READ_SIZE), b''):
+      client._write(chunk)
+  if profile:
+    client.profile.extend(profile)
+
+
+def _program_target(client, args, target, program):
+  '''Program and verify one target on a worker of its own.'''
+  def work(worker):
+    with worker.batch():
+      preamble(worker, args)
+
+      worker.open_hw_manager()
+      worker.connect_hw_server(args.hw_server)
+      worker.open_hw_target(target)
+      program(worker, args)
+    success = worker.is_done()
+    worker.close_hw_manager()
+    return success
+
+  start = time.perf_counter()
+  success, output, profile = _on_worker(client, args, work)
+  result = {'target': target, 'success': success, 'time': time.perf_counter() - start}
+  return result, output, profile
+
+
+def program_all_targets(client, args, program):
+  '''Program every target on the hardware server concurrently, reporting results per target.'''
+  client.open_hw_manager()
+  client.connect_hw_server(args.hw_server)
+  targets = client.get_hw_targets()
   client.close_hw_manager()
+  # Free this connection's worker for programming.
+  client.end_session()
+
+  if not targets:
+    client._write(make_red(b'\nNo hardware targets found.\n'))
+    raise CommandFailure()
+
+  # Each target waits for a free server worker, so by default all are submitted at once.
+  with concurrent.futures.ThreadPoolExecutor(args.jobs or len(targets)) as executor:
+    futures = [executor.submit(_program_target, client, args, target, program)
+               for target in targets]
+
+  results = []
+  for future in futures:
+    result, output, profile = future.result()
+    _replay(client, output, profile)
+    results.append(result)
+
+  client._write(b'\n')
+  for result in results:
+    status = make_green(b'PASSED') if result['success'] else make_red(b'FAILED')
+    client._write('{:s} ({:.1f} s): '.format(result['target'], result['time']).encode() + status +
+                  b'\n')
+
+  if args.results:
+    with open(args.results, 'w') as f:
+      json.dump(results, f, indent=2)
+
+  if not all(result['success'] for result in results):
+    raise CommandFailure()
+
+
+CHECKS = ('check_timing', 'report_drc', 'report_methodology', 'report_timing')
 
 
 def _check(client):
-  success = True
-  success &= client.check_timing()
-  success &= client.report_drc()
-  success &= client.report_methodology()
-  success &= client.report_timing()
+  '''Run each check, returning whether each passed by name.'''
+  results = {}
+  for name in CHECKS:
+    results[name] = getattr(client, name)()
+
+  return results
+
+
+def _check_worker(client, args, name, connections):
+  '''Open the design and run a single check on a worker of its own.'''
+  def work(worker):
+    with worker.batch():
+      _open_checkpoint(worker, args)
+    return getattr(worker, name)()
+
+  return _on_worker(client, args, work, connections)
+
+
+def _parallel_checks(client, args):
+  '''Whether to run the checks on workers of their own, which needs a server with more than one.'''
+  if not args.parallel_checks:
+    return False
+  status = server_status(client.address)
+  return bool(status) and status['workers'] > 1
+
 
-  return success
+def _start_parallel_checks(client, args):
+  connections = _Connections()
+  executor = concurrent.futures.ThreadPoolExecutor(len(CHECKS))
+  futures = [executor.submit(_check_worker, client, args, name, connections) for name in CHECKS]
+  executor.shutdown(wait=False)
+  return futures, connections
+
+
+def _abandon_parallel_checks(checks):
+  '''Stop checks whose results are no longer needed, rather than let them hold workers, and the
+  client's exit, until they finish.
+  '''
+  futures, connections = checks
+  for future in futures:
+    future.cancel()
+  connections.abandon()
+
+
+def _finish_parallel_checks(client, checks):
+  futures, _ = checks
+  results = {}
+  for name, future in zip(CHECKS, futures):
+    success, output, profile = future.result()
+    _replay(client, output, profile)
+    results[name] = success
+
+  return results
 
 
 def check(client, args):
-  preamble(client, args)
+  if _parallel_checks(client, args):
+    # Free this connection's worker for the checks.
+    client.end_session()
+    results = _finish_parallel_checks(client, _start_parallel_checks(client, args))
+  else:
+    with client.batch():
+      _open_checkpoint(client, args)
 
-  client.read_checkpoint(args.input)
-  client.link_design()
+    results = _check(client)
 
-  if not _check(client):
+  if not all(results.values()):
     raise CommandFailure()
 
+  if args.output:
+    with open(args.output, 'w') as f:
+      for name, success in results.items():
+        f.write('{:s}: {:s}\n'.format(name, 'PASSED' if success else 'FAILED'))
 
-def main():
-  parser = argparse.ArgumentParser(description='Client for interacting with Vivado.')
+
+def load_white_list(filename):
+  '''Read message IDs, one per line, ignoring blank lines and # comments.'''
+  white_list = set()
+  with open(filename, 'rb') as f:
+    for line in f:
+      message_id = line.partition(b'#')[0].strip()
+      if message_id:
+        white_list.add(message_id)
+
+  return white_list
+
+
+# Arguments naming input files, output files, and those that do not affect the result.
+CACHE_INPUTS = ('verilog', 'constraint', 'bitstream_constraint', 'input', 'incremental',
+                'ooc_checkpoint', 'white_list', 'waivers')
+CACHE_OUTPUTS = ('output', 'stub', 'synth_checkpoint', 'place_checkpoint', 'route_checkpoint',
+                 'message_log', 'profile')
+CACHE_IGNORED = ('func', 'host', 'port', 'servers', 'registry', 'verbose', 'cache_dir',
+                 'cache_size', 'parallel_checks', 'session')
+# Client modules that determine the Tcl sent, how its output is judged and files written directly.
+CACHE_SOURCES = (__file__, config_memory.__file__, process_manager.__file__, report_parser.__file__)
+
+
+def _hash_file(h, path):
+  h.update(os.path.basename(path).encode())
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+      h.update(chunk)
+
+
+def cache_key(args):
+  '''Hash of everything that determines the Tcl command stream and its inputs.
+
+  The command stream is fully determined by the client sources and its arguments, so those are
+  hashed with file arguments replaced by their contents.  Paths are left out so builds in different
+  sandboxes share results.
+  '''
+  h = hashlib.sha256()
+  for source in CACHE_SOURCES:
+    _hash_file(h, source)
+
+  for name, value in sorted(vars(args).items()):
+    if name in CACHE_IGNORED:
+      continue
+
+    h.update(name.encode())
+    if name in CACHE_INPUTS and value:
+      for path in value if isinstance(value, list) else [value]:
+        _hash_file(h, path)
+    elif name in CACHE_OUTPUTS:
+      h.update(b'1' if value else b'0')
+    else:
+      h.update(repr(value).encode())
+
+  return h.hexdigest()
+
+
+def cache_outputs(args):
+  return {name: getattr(args, name) for name in CACHE_OUTPUTS if getattr(args, name, None)}
+
+
+def cache_stats(args):
+  cache = result_cache.ResultCache(args.cache_dir, int(args.cache_size * 1024**3))
+  stats = cache.stats()
+
+  print('Lookups:  {:d}'.format(stats['hits'] + stats['misses']))
+  print('Hits:     {:d} ({:.1%})'.format(stats['hits'], stats['hit_rate']))
+  print('Misses:   {:d}'.format(stats['misses']))
+  print('Entries:  {:d}'.format(stats['entries']))
+  print('Size:     {:.2f} / {:.2f} GB'.format(stats['size'] / 1024**3, stats['max_size'] / 1024**3))
+
+
+def write_profile(args, client, wall):
+  profile = {
+      'command': args.command,
+      'wall': wall,
+      'output_bytes': sum(entry['output_bytes'] for entry in client.profile),
+      'steps': client.profile,
+  }
+
+  with open(args.profile, 'w') as f:
+    json.dump(profile, f, indent=2)
+
+
+def make_parser():
+  # Bazel passes arguments in a flag file, one per line, so they fit within command line limits.
+  parser = argparse.ArgumentParser(description='Client for interacting with Vivado.',
+                                   fromfile_prefix_chars='@')
   subparsers = parser.add_subparsers(help='Command to perform.', dest='command')
   subparsers.required = True
 
@@ -485,6 +1265,25 @@ def main():
                              help='Display all output, not just errors.')
   parser_parent.add_argument('--host', default='localhost', help='A hostname to which to connect.')
   parser_parent.add_argument('--port', type=int, default=9191, help='A port number for connection.')
+  parser_parent.add_argument('--servers', type=lambda s: s.split(','),
+                             default=os.environ.get('RULES_VIVADO_SERVERS', '').split(','),
+                             help='Comma separated host:port of servers to balance load between, '
+                             'in place of --host and --port.')
+  parser_parent.add_argument('--registry', default=os.environ.get('RULES_VIVADO_REGISTRY'),
+                             help='File listing servers to balance load between, one host:port per '
+                             'line.')
+  parser_parent.add_argument('--session', default=os.environ.get('RULES_VIVADO_SESSION'),
+                             help='Session ID used to prefer the worker that served it last.')
+  parser_parent.add_argument('--white_list',
+                             help='File of additional message IDs to treat as informational.')
+  parser_parent.add_argument('--waivers',
+                             help='File of check violations, by rule ID and an optional regex '
+                             'matching their details, not treated as errors.')
+  parser_parent.add_argument('--message_log',
+                             help='File to which messages are written as JSON lines.')
+  parser_parent.add_argument('--profile',
+                             help='File to which per command timing and resource usage is written '
+                             'as JSON.')
 
   # Output Argument.
   parser_output = argparse.ArgumentParser(add_help=False)
@@ -494,32 +1293,77 @@ def main():
   parser_input = argparse.ArgumentParser(add_help=False)
   parser_input.add_argument('-i', '--input', required=True, help='Input file.')
 
+  # Result Cache Arguments.
+  parser_cache = argparse.ArgumentParser(add_help=False)
+  parser_cache.add_argument('--cache_dir', default=os.environ.get('RULES_VIVADO_CACHE_DIR'),
+                            help='Directory of result cache shared between builds.')
+  parser_cache.add_argument('--cache_size', type=float, default=50,
+                            help='Maximum size of result cache [GB].')
+
+  # Hardware Arguments.
+  parser_hw = argparse.ArgumentParser(add_help=False)
+  parser_hw.add_argument('--hw_server', help='Hardware server URL, localhost:3121 by default.')
+  parser_hw.add_argument('--all_targets', action='store_true',
+                         help='Program every target on the hardware server concurrently.')
+  parser_hw.add_argument('--jobs', type=int,
+                         help='Maximum number of targets programmed at once, all by default.')
+  parser_hw.add_argument('--results', help='File to which per target results are written as JSON.')
+
   # Synth Command.
-  parser_synth = subparsers.add_parser('synth', parents=[parser_parent, parser_output],
+  parser_synth = subparsers.add_parser('synth', parents=[parser_parent, parser_cache, parser_output],
                                        help='Synthesize design.')
   parser_synth.add_argument('-v', '--verilog', nargs='+', required=True, help='Verilog file.')
   parser_synth.add_argument('-t', '--top', required=True, help='Top level module name.')
+  parser_synth.add_argument('--ooc', action='store_true',
+                            help='Synthesize out-of-context, for linking into a larger design.')
+  parser_synth.add_argument('--stub',
+                            help='Verilog stub written for instantiating the module as a black box.')
+  parser_synth.add_argument('--ooc_checkpoint', nargs='+',
+                            help='Out-of-context checkpoints linked into black boxes.')
   parser_synth.set_defaults(func=synthesize)
 
   # Place Command.
   parser_place = subparsers.add_parser('place',
-                                       parents=[parser_parent, parser_input, parser_output],
+                                       parents=[parser_parent, parser_cache, parser_input,
+                                                parser_output],
                                        help='Place design.')
+  parser_place.add_argument('--incremental',
+                            help='Routed checkpoint to use as an incremental reference.')
   parser_place.set_defaults(func=place)
 
   # Route Command.
   parser_route = subparsers.add_parser('route',
-                                       parents=[parser_parent, parser_input, parser_output],
+                                       parents=[parser_parent, parser_cache, parser_input,
+                                                parser_output],
                                        help='Route design.')
   parser_route.set_defaults(func=route)
 
   # Bitstream Command.
   parser_bitstream = subparsers.add_parser('bitstream',
-                                           parents=[parser_parent, parser_input, parser_output],
+                                           parents=[parser_parent, parser_cache, parser_input,
+                                                    parser_output],
                                            help='Write bitstream.')
   parser_bitstream.add_argument('--check', action='store_true', help='Perform check on design.')
+  parser_bitstream.add_argument('--parallel_checks', action='store_true',
+                                help='Run each check concurrently on a separate server worker.')
   parser_bitstream.set_defaults(func=bitstream)
 
+  # Implement Command.
+  parser_impl = subparsers.add_parser('impl', parents=[parser_parent, parser_cache, parser_output],
+                                      help='Synthesize, place, route and write bitstream in a '
+                                      'single session.')
+  parser_impl.add_argument('-v', '--verilog', nargs='+', required=True, help='Verilog file.')
+  parser_impl.add_argument('-t', '--top', required=True, help='Top level module name.')
+  parser_impl.add_argument('--bitstream_constraint', nargs='+',
+                           help='Constraint file for bitstream generation.')
+  parser_impl.add_argument('--synth_checkpoint', help='Optional post synthesis checkpoint.')
+  parser_impl.add_argument('--place_checkpoint', help='Optional post placement checkpoint.')
+  parser_impl.add_argument('--route_checkpoint', help='Optional post route checkpoint.')
+  parser_impl.add_argument('--incremental',
+                           help='Routed checkpoint to use as an incremental reference.')
+  parser_impl.add_argument('--check', action='store_true', help='Perform check on design.')
+  parser_impl.set_defaults(func=implement)
+
   # Configuration Memory Command.
   valid_interfaces = [
       'SMAPx8', 'SMAPx16', 'SMAPx32', 'SERIALx1',
@@ -531,46 +1375,313 @@ def main():
   parser_cfg_mem.add_argument('--size', type=int, required=True, help='Memory size [MB].')
   parser_cfg_mem.add_argument('--interface', choices=valid_interfaces, required=True,
                               help='Memory size [MB].')
+  parser_cfg_mem.add_argument('--vivado', action='store_true',
+                              help='Always write with Vivado, rather than directly for serial '
+                              'interfaces.')
+  parser_cfg_mem.add_argument('--verify', action='store_true',
+                              help='Compare the directly written file with Vivado\'s output.')
   parser_cfg_mem.set_defaults(func=cfg_mem)
 
   # Load Command.
   parser_load = subparsers.add_parser('load',
-                                      parents=[parser_parent, parser_input],
+                                      parents=[parser_parent, parser_hw, parser_input],
                                       help='Load bitstream.')
   parser_load.set_defaults(func=load)
 
   # Flash Command.
   parser_flash = subparsers.add_parser('flash',
-                                       parents=[parser_parent, parser_input],
+                                       parents=[parser_parent, parser_hw, parser_input],
                                        help='Flash bitstream to configuration memory.')
   parser_flash.add_argument('--memory', required=True, help='Vivado memory part number.')
   parser_flash.set_defaults(func=flash)
 
   # Check Command.
   parser_check = subparsers.add_parser('check',
-                                       parents=[parser_parent, parser_input],
+                                       parents=[parser_parent, parser_cache, parser_input],
                                        help='Run design checks.')
+  parser_check.add_argument('-o', '--output', help='Optional report file written on success.')
+  parser_check.add_argument('--parallel_checks', action='store_true',
+                            help='Run each check concurrently on a separate server worker.')
   parser_check.set_defaults(func=check)
 
-  # Execute command.
-  args = parser.parse_args()
+  # Cache Stats Command.
+  parser_cache_stats = subparsers.add_parser('cache_stats', parents=[parser_cache],
+                                             help='Report result cache statistics.')
+  parser_cache_stats.set_defaults(func=cache_stats)
+
+  return parser
+
+
+def server_addresses(args):
+  '''Servers from --servers and the --registry file, otherwise the one at --host and --port.'''
+  servers = list(args.servers)
+  if args.registry:
+    with open(args.registry) as f:
+      servers += [line.partition('#')[0].strip() for line in f]
+
+  addresses = []
+  for server in filter(None, servers):
+    host, _, port = server.rpartition(':')
+    addresses.append((host, int(port)) if host else (server, args.port))
+
+  return addresses or [(args.host, args.port)]
+
+
+def server_status(address, timeout=2.0):
+  '''Ask a server for its worker, idle worker and waiting connection counts, or None when it does
+  not answer.
+  '''
+  try:
+    with socket.create_connection(address, timeout) as s:
+      s.sendall(process_manager.control_line('status') + b'\r')
+      reply = b''
+      while not reply.endswith(b'\n'):
+        data = s.recv(4096)
+        if not data:
+          return None
+        reply += data
+  except OSError:
+    return None
 
-  with VivadoClient(args.host, args.port, args.verbose) as client:
+  command, status = process_manager.parse_control_line(reply)
+  return status if command == 'status' else None
+
+
+def _load(status):
+  # Unreachable servers are tried last, and ties are broken at random so clients starting at once
+  # spread out.
+  if not status:
+    return (1, 0, random.random())
+  busy = status['workers'] - status['idle'] + status['waiting']
+  return (0, busy / max(1, status['workers']), random.random())
+
+
+def rank_servers(addresses):
+  '''Order servers from least to most loaded relative to their number of workers.'''
+  if len(addresses) < 2:
+    return addresses
+
+  with concurrent.futures.ThreadPoolExecutor(len(addresses)) as executor:
+    statuses = list(executor.map(server_status, addresses))
+
+  return [address for address, status in sorted(zip(addresses, statuses),
+                                                key=lambda item: _load(item[1]))]
+
+
+def _open(address, args, white_list, message_log, waivers, clients):
+  '''Reuse an open connection to the server from `clients` where possible, otherwise connect.'''
+  client = clients.pop(address, None) if clients is not None else None
+
+  if client:
+    client.configure(args.verbose, white_list, message_log, waivers)
     try:
-      client.change_directory(os.getcwd())
-      args.func(client, args)
-    except (CommandTimeout, CommandFailure):
+      open_session(client, args)
+      return client
+    except OSError:  # The server restarted since the last command.
+      client.close()
+
+  client = VivadoClient(*address, args.verbose, white_list, message_log, waivers)
+  try:
+    open_session(client, args)
+  except OSError:
+    client.close()
+    raise
+  return client
+
+
+def _connect(args, white_list, message_log, waivers, clients, exclude=()):
+  '''Open a session on the least loaded server that answers, skipping those in `exclude`.
+
+  Raises ConnectionError, listing why each server failed, when none answers.
+  '''
+  errors = []
+  for address in rank_servers([a for a in server_addresses(args) if a not in exclude]):
+    try:
+      return _open(address, args, white_list, message_log, waivers, clients)
+    except OSError as e:
+      errors.append('{:s}:{:d}: {}'.format(*address, e))
+
+  if not errors:
+    raise ConnectionError('No servers left to try.')
+  raise ConnectionError('Could not connect to a server:\n  ' + '\n  '.join(errors))
+
+
+def execute(args, clients=None):
+  '''Perform a parsed command, returning the exit code.
+
+  Connections are kept open in `clients`, keyed by server address, when given so a persistent worker
+  reuses them across commands.
+  '''
+  cache = None
+  if getattr(args, 'cache_dir', None):
+    cache = result_cache.ResultCache(args.cache_dir, int(args.cache_size * 1024**3))
+
+  if args.func is cache_stats:
+    if not cache:
+      sys.stderr.write('--cache_dir or RULES_VIVADO_CACHE_DIR is required.\n')
+      return 2
+    cache_stats(args)
+    return 0
+
+  # Replay cached outputs and log without connecting to Vivado.
+  if cache:
+    key = cache_key(args)
+    with open(sys.stdout.fileno(), 'wb', closefd=False) as stdout:
+      if cache.restore(key, cache_outputs(args), stdout):
+        return 0
+
+  # Configuration memory for serial interfaces is a plain copy, which needs no server.
+  if args.func is cfg_mem and not args.verify:
+    try:
+      if write_cfg_mem(args):
+        return 0
+    except (OSError, config_memory.BitstreamError) as e:
+      os.write(sys.stdout.fileno(), make_red('\n{}\nCommand Failed.\n'.format(e).encode()))
+      return 1
+
+  white_list = load_white_list(args.white_list) if args.white_list else ()
+  waivers = report_parser.load_waivers(args.waivers) if args.waivers else ()
+  message_log = open(args.message_log, 'w') if args.message_log else None
+
+  client = None
+  failed = []
+  start = time.perf_counter()
+  try:
+    while True:
+      client = _connect(args, white_list, message_log, waivers, clients, failed)
+      if cache:
+        client.log = spill_file()
+      if args.profile:
+        client.profile = []
+
+      try:
+        args.func(client, args)
+        break
+      except ConnectionError:
+        # The server went away mid command, so the command starts over on another server.
+        client.close()
+        if client.log:
+          client.log.close()
+        failed.append(client.address)
+        if all(address in failed for address in server_addresses(args)):
+          raise ConnectionError('Lost connection to {:s}:{:d}, with no other server to retry on.'
+                                .format(*client.address))
+        os.write(sys.stdout.fileno(), make_yellow(
+            '\nLost connection to {:s}:{:d}, retrying on another server.\n'.format(
+                *client.address).encode()))
+        if message_log:
+          message_log.seek(0)
+          message_log.truncate()
+  except (CommandTimeout, CommandFailure, ConnectionError) as e:
+    # The connection may be left mid command, so it is not reused.
+    if client:
+      client.close()
+    # Not every command has an output, e.g. check without -o.
+    if getattr(args, 'output', None):
       try:
         os.remove(args.output)
-      except (OSError, AttributeError):
+      except OSError:
+        pass
+    message = b'\nCommand Failed.\n'
+    if isinstance(e, ConnectionError):
+      # No server could be reached, or every one went away mid command.
+      message = '\n{}\nCommand Failed.\n'.format(e).encode()
+    os.write(sys.stdout.fileno(), make_red(message))
+    return 1
+  finally:
+    if args.profile and client:
+      write_profile(args, client, time.perf_counter() - start)
+    if message_log:
+      message_log.close()
+
+  if clients is None:
+    client.close()
+  else:
+    client.end_session()
+    clients[client.address] = client
+
+  # Caching is best effort, e.g. the directory may not be writable from a sandbox.
+  if cache:
+    with client.log:
+      client.log.seek(0)
+      try:
+        cache.store(key, cache_outputs(args), client.log)
+      except OSError:
         pass
-      os.write(sys.stdout.fileno(), make_red(b'\nCommand Failed.\n'))
-      sys.exit(1)
 
   # Give a final return character.
   if args.verbose:
     os.write(sys.stdout.fileno(), b'\n')
 
+  return 0
+
+
+def _read_work_requests(stream):
+  '''Yield JSON work requests from Bazel, which may each span several lines.'''
+  decoder = json.JSONDecoder()
+  buffer = ''
+  for line in stream:
+    buffer += line
+    try:
+      request, _ = decoder.raw_decode(buffer.strip())
+    except ValueError:
+      continue
+
+    buffer = ''
+    yield request
+
+
+def persistent_worker(parser):
+  '''Serve Bazel persistent worker requests on stdin until Bazel closes it.
+
+  Responses are written to stdout, so the output of each command is captured by pointing stdout and
+  stderr at a temporary file while it runs.
+  '''
+  responses = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+  saved = [os.dup(fd) for fd in (1, 2)]
+  clients = {}
+
+  for request in _read_work_requests(sys.stdin):
+    with tempfile.TemporaryFile() as output:
+      for fd in (1, 2):
+        os.dup2(output.fileno(), fd)
+
+      try:
+        exit_code = execute(parser.parse_args(request.get('arguments', [])), clients)
+      except SystemExit as e:  # Invalid arguments.
+        exit_code = e.code if isinstance(e.code, int) else 1
+      except Exception:
+        traceback.print_exc()
+        exit_code = 1
+      finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, saved_fd in zip((1, 2), saved):
+          os.dup2(saved_fd, fd)
+
+      output.seek(0)
+      response = {
+          'exitCode': exit_code,
+          'output': output.read().decode(errors='replace'),
+          'requestId': request.get('requestId', 0),
+      }
+
+    responses.write(json.dumps(response) + '\n')
+    responses.flush()
+
+  for client in clients.values():
+    client.close()
+
+
+def main():
+  parser = make_parser()
+
+  if '--persistent_worker' in sys.argv[1:]:
+    persistent_worker(parser)
+    return
+
+  sys.exit(execute(parser.parse_args()))
+
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,227 @@
+import contextlib
+import json
+import os
+import os.path
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import process_manager
+import vivado_client
+import vivado_server
+
+
+FAKE_VIVADO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_vivado.py')
+PART = 'xc7a35ticsg324-1l'
+
+
+def free_port():
+  with socket.socket() as s:
+    s.bind(('localhost', 0))
+    return s.getsockname()[1]
+
+
+def start_server(workers, *fake_args):
+  '''Serve fake Vivado workers on a free port, as vivado_server.py serves Vivado.'''
+  monitors = [process_manager.ProcessMonitor([sys.executable, FAKE_VIVADO] + list(fake_args))
+              for _ in range(workers)]
+  pool = process_manager.ProcessPool(monitors)
+  server = process_manager.ProcessServer(pool, port=free_port(), reset=vivado_server.reset_worker,
+                                         frame=vivado_server.frame_request)
+  server.run()
+  server.listening.wait()
+  return server
+
+
+@contextlib.contextmanager
+def captured_stdout():
+  '''Collect what the client writes to the stdout file descriptor, available once it exits.'''
+  output = bytearray()
+  sys.stdout.flush()
+  saved = os.dup(sys.stdout.fileno())
+  with tempfile.TemporaryFile() as f:
+    os.dup2(f.fileno(), sys.stdout.fileno())
+    try:
+      yield output
+    finally:
+      sys.stdout.flush()
+      os.dup2(saved, sys.stdout.fileno())
+      os.close(saved)
+      f.seek(0)
+      output.extend(f.read())
+
+
+class FailoverTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+
+    # Routing takes long enough for a server to go away mid action.
+    script = self.path('script.json')
+    with open(script, 'w') as f:
+      json.dump({'route_design': {'latency': 2}}, f)
+
+    self.servers = [start_server(1, '--script', script) for _ in range(2)]
+    for server in self.servers:
+      self.addCleanup(self._stop, server)
+
+    self.input = self.path('placed.dcp')
+    with open(self.input, 'w') as f:
+      f.write('placed\n')
+
+  def path(self, name):
+    return os.path.join(self.directory.name, name)
+
+  def _stop(self, server):
+    if server.is_alive():
+      server.stop()
+
+  def _servers_arg(self):
+    return ','.join('localhost:{:d}'.format(server.port) for server in self.servers)
+
+  def test_least_loaded_server_first(self):
+    busy, idle = self.servers
+    with vivado_client.VivadoClient('localhost', busy.port, False) as client:
+      client.begin_session(None, PART)
+
+      addresses = [('localhost', busy.port), ('localhost', idle.port)]
+      self.assertEqual(vivado_client.rank_servers(addresses)[0], ('localhost', idle.port))
+
+  def test_action_finishes_on_other_server(self):
+    output = self.path('routed.dcp')
+    args = vivado_client.make_parser().parse_args(
+        ['route', '-p', PART, '--servers', self._servers_arg(), '-i', self.input, '-o', output])
+
+    result = {}
+    with captured_stdout() as stdout:
+      thread = threading.Thread(target=lambda: result.update(rc=vivado_client.execute(args)))
+      thread.start()
+
+      # Stop whichever server took the action while it routes.
+      deadline = time.monotonic() + 10
+      taken = None
+      while taken is None and time.monotonic() < deadline:
+        for server in self.servers:
+          if server.status()['idle'] == 0:
+            taken = server
+        time.sleep(0.05)
+      self.assertIsNotNone(taken)
+      time.sleep(0.5)
+      taken.stop()
+
+      thread.join(30)
+    self.assertFalse(thread.is_alive())
+
+    self.assertEqual(result['rc'], 0)
+    self.assertIn('Lost connection to localhost:{:d}'.format(taken.port).encode(), stdout)
+    with open(output) as f:
+      self.assertIn('write_checkpoint', f.read())
+
+  def test_no_server_answers(self):
+    for server in self.servers:
+      server.stop()
+    output = self.path('routed.dcp')
+    args = vivado_client.make_parser().parse_args(
+        ['route', '-p', PART, '--servers', self._servers_arg(), '-i', self.input, '-o', output])
+
+    with captured_stdout() as stdout:
+      rc = vivado_client.execute(args)
+
+    self.assertEqual(rc, 1)
+    self.assertIn(b'Could not connect to a server:', stdout)
+    self.assertIn(b'Command Failed.', stdout)
+    self.assertFalse(os.path.exists(output))
+
+
+class BatchTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+
+    # Reading constraints reports a critical warning.
+    with open(self.path('read_xdc.log'), 'w') as f:
+      f.write('CRITICAL WARNING: [Designutils 20-1307] Command get_ports not found.\n')
+    with open(self.path('script.json'), 'w') as f:
+      json.dump({'read_xdc': {'output': 'read_xdc.log'}}, f)
+
+    self.server = start_server(1, '--script', self.path('script.json'))
+    self.addCleanup(self.server.stop)
+
+    for name in ('placed.dcp', 'top.xdc'):
+      with open(self.path(name), 'w') as f:
+        f.write(name + '\n')
+
+  def path(self, name):
+    return os.path.join(self.directory.name, name)
+
+  def place(self, *extra_args):
+    args = vivado_client.make_parser().parse_args(
+        ['place', '-p', PART, '--servers', 'localhost:{:d}'.format(self.server.port),
+         '-c', self.path('top.xdc'), '-i', self.path('placed.dcp'), '-o', self.path('out.dcp'),
+         '--profile', self.path('profile.json')] + list(extra_args))
+    with captured_stdout():
+      rc = vivado_client.execute(args)
+
+    with open(self.path('profile.json')) as f:
+      return rc, [(step['command'], step['success']) for step in json.load(f)['steps']]
+
+  def test_messages_stop_batch(self):
+    rc, steps = self.place()
+
+    self.assertEqual(rc, 1)
+    self.assertEqual(steps[-1], ('read_xdc', False))
+    self.assertFalse(os.path.exists(self.path('out.dcp')))
+
+  def test_white_listed_messages_continue(self):
+    with open(self.path('white_list.txt'), 'w') as f:
+      f.write('Designutils 20-1307\n')
+    rc, steps = self.place('--white_list', self.path('white_list.txt'))
+
+    self.assertEqual(rc, 0)
+    self.assertEqual(steps[-1], ('write_checkpoint', True))
+    self.assertTrue(os.path.exists(self.path('out.dcp')))
+
+
+class ProgramAllTargetsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+
+    # The last of three boards fails to program.
+    self.server = start_server(3, '--hw_targets', '3', '--bad_targets', '1')
+    self.addCleanup(self.server.stop)
+
+    self.bitstream = os.path.join(self.directory.name, 'top.bit')
+    with open(self.bitstream, 'w') as f:
+      f.write('bitstream\n')
+
+  def test_results_per_target(self):
+    results = os.path.join(self.directory.name, 'results.json')
+    args = vivado_client.make_parser().parse_args(
+        ['load', '-p', PART, '--servers', 'localhost:{:d}'.format(self.server.port),
+         '--all_targets', '--results', results, '-i', self.bitstream])
+
+    with captured_stdout() as stdout:
+      rc = vivado_client.execute(args)
+
+    self.assertEqual(rc, 1)
+    with open(results) as f:
+      results = json.load(f)
+    self.assertEqual([result['target'] for result in results],
+                     ['localhost:3121/xilinx_tcf/Fake/{:04d}'.format(i) for i in range(3)])
+    self.assertEqual([result['success'] for result in results], [True, True, False])
+
+    summary = stdout[stdout.rindex(b'Fake/0000 ('):]
+    self.assertEqual(summary.count(b'PASSED'), 2)
+    self.assertEqual(summary.count(b'FAILED'), 1)
+    self.assertIn(b'Command Failed.', summary)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -3,16 +3,116 @@
 import argparse
 import os
 import os.path
+import re
+import signal
 import socket
+import weakref
 
 import process_manager
 
 
+PROMPT = b'Vivado% '
+RESET_DONE = re.compile(rb'RULES_VIVADO_RESET:(\d+)\r?\n' + re.escape(PROMPT) + rb'$')
+RESET_TIMEOUT = 300
+
+# Upper limit of general.maxThreads on Linux.
+MAX_THREADS = 8
+
+
+def reset_worker(monitor, state):
+  '''Close the last design and set its part, if any, while the worker is idle.
+
+  The next client on the same part then finds an empty project with its part already set.
+  '''
+  set_part = '[catch {{set_part {:s}}}]'.format(state['part']) if state['part'] else '0'
+  cmd = 'catch {{close_project}}; puts "RULES_VIVADO_RESET:{:s}"\r'.format(set_part)
+  output = monitor.execute(cmd.encode(), RESET_DONE.search, RESET_TIMEOUT)
+  return output is not None and RESET_DONE.search(output).group(1) == b'0'
+
+
+def frame_request(request_id, script):
+  '''Tcl running a client's script at global scope between frame markers, echoing its result as the
+  interactive shell would.  The script must have balanced braces, as any Tcl command does.
+
+  The markers are written with an escape, so echoed input never contains them.
+  '''
+  marker = process_manager.FRAME_MARKER.decode().replace('\x02', '\\x02')
+  return (
+      'puts "{marker}{id:d} begin"; '
+      'set rules_vivado_rc [catch {{uplevel #0 {{{script:s}}}}} rules_vivado_result]; '
+      'if {{$rules_vivado_result ne ""}} {{puts $rules_vivado_result}}; '
+      'puts "{marker}{id:d} end $rules_vivado_rc"'
+  ).format(marker=marker, id=request_id, script=script).encode()
+
+
+class ThreadBudget:
+  '''Shares a budget of CPUs between the workers through Vivado's general.maxThreads.
+
+  Vivado reads the parameter when a command starts, so before each command its worker is given an
+  even share of the budget among the busy workers.  A lone route then gets all the threads it can
+  use, while many concurrent synthesis runs get one or two each rather than oversubscribing.
+  '''
+
+  def __init__(self, pool, cpus, max_threads=MAX_THREADS):
+    self.pool = pool
+    self.cpus = cpus
+    self.max_threads = max_threads
+    # The setting last sent to each worker, so it is only sent again when the share changes.
+    self.threads = weakref.WeakKeyDictionary()
+
+  def share(self):
+    return max(1, min(self.max_threads, self.cpus // max(1, self.pool.busy())))
+
+  def __call__(self, monitor, line):
+    threads = self.share()
+    if not line.strip() or self.threads.get(monitor) == threads:
+      return line
+
+    self.threads[monitor] = threads
+    # Caught, as an error would stop the rest of the line, e.g. a framed request's end marker.
+    return 'catch {{set_param general.maxThreads {:d}}}; '.format(threads).encode() + line
+
+
+class RecyclePolicy:
+  '''Retires workers that have served `max_jobs` sessions or hold `max_rss` bytes of memory.
+
+  Vivado does not return the memory of closed designs, so long-lived workers grow until the host
+  swaps.  Either limit is disabled by 0.
+  '''
+
+  def __init__(self, max_rss, max_jobs):
+    self.max_rss = max_rss
+    self.max_jobs = max_jobs
+
+  def __call__(self, monitor):
+    if self.max_jobs and monitor.jobs >= self.max_jobs:
+      return True
+    return bool(self.max_rss) and monitor.rss() >= self.max_rss
+
+
 def main():
   parser = argparse.ArgumentParser(description='Server for interacting with Vivado.')
   parser.add_argument('--exec_path', default='vivado', help='Path to Vivado executable.')
   parser.add_argument('--host', default='localhost', help='A hostname to which to connect.')
   parser.add_argument('--port', type=int, default=9191, help='A port number for connection.')
+  parser.add_argument('--workers', type=int, default=1,
+                      help='Number of Vivado processes serving connections in parallel.')
+  parser.add_argument('--buffer_size', type=int, default=16,
+                      help='Output buffered per worker before Vivado is paused [MB].')
+  parser.add_argument('--read_size', type=int, default=1024,
+                      help='Maximum output read from Vivado at once [KB].')
+  parser.add_argument('--cpus', type=int, default=os.cpu_count(),
+                      help='CPUs shared by the workers\' Vivado threads, or 0 to leave Vivado\'s '
+                      'thread count alone.')
+  parser.add_argument('--max_threads', type=int, default=MAX_THREADS,
+                      help='Most threads given to a single worker.')
+  parser.add_argument('--recycle_memory', type=float, default=0,
+                      help='Memory of a worker after which it is replaced, or 0 for no limit [GB].')
+  parser.add_argument('--recycle_jobs', type=int, default=0,
+                      help='Sessions a worker serves before it is replaced, or 0 for no limit.')
+  parser.add_argument('--cancel_timeout', type=float, default=10.0,
+                      help='Time an interrupted worker has to stop the command of a client that '
+                      'disconnected before it is replaced [s].')
   args = parser.parse_args()
 
   vivado_args = [
@@ -23,8 +123,31 @@ def main():
       '-nojournal'
   ]
 
-  monitor = process_manager.ProcessMonitor(vivado_args, True, True, True)
-  server = process_manager.ProcessServer(monitor, args.host, args.port)
+  if args.workers < 1:
+    parser.error('--workers must be at least 1.')
+  if args.cpus < 0:
+    parser.error('--cpus must not be negative.')
+  if not 1 <= args.max_threads <= MAX_THREADS:
+    parser.error('--max_threads must be between 1 and {:d}.'.format(MAX_THREADS))
+  if args.recycle_memory < 0 or args.recycle_jobs < 0:
+    parser.error('--recycle_memory and --recycle_jobs must not be negative.')
+
+  # Workers are interrupted with SIGINT, which they would inherit ignoring from a server started in
+  # the background by a script.
+  signal.signal(signal.SIGINT, signal.default_int_handler)
+
+  # Only the first worker is attached to the interactive terminal.
+  monitors = [process_manager.ProcessMonitor(vivado_args, i == 0, True, i == 0,
+                                             buffer_size=args.buffer_size * 1024 * 1024,
+                                             read_size=args.read_size * 1024)
+              for i in range(args.workers)]
+  pool = process_manager.ProcessPool(monitors)
+  budget = ThreadBudget(pool, args.cpus, args.max_threads) if args.cpus else None
+  recycle = None
+  if args.recycle_memory or args.recycle_jobs:
+    recycle = RecyclePolicy(int(args.recycle_memory * 1024**3), args.recycle_jobs)
+  server = process_manager.ProcessServer(pool, args.host, args.port, reset_worker, budget,
+                                         frame_request, recycle, args.cancel_timeout)
   server.serve_forever()
 
   temp_files = [